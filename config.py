@@ -1,36 +1,65 @@
 import os
+import atexit
 import logging
+from logging.handlers import MemoryHandler
 
 # Файл логирования
 LOG_FILE = 'packer.log'
 
+# Формат сообщений лога
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Количество записей, накапливаемых перед записью в файл лога
+LOG_BUFFER_CAPACITY = 1024
+
 # Настройка логирования
 
 
 def setup_logging():
     """Настраивает логирование приложения"""
-    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    log_format = LOG_FORMAT
     logger = logging.getLogger('packer')
+
+    # Повторный вызов не добавляет обработчики и не обнуляет файл лога
+    if getattr(logger, '_configured', False):
+        return logger
+
     logger.setLevel(logging.INFO)
+    # Записи обрабатываются только здесь, без повторного вывода через корневой логгер
+    logger.propagate = False
 
     # Удаляем все существующие обработчики логов
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
         handler.close()
+        # Буферный обработчик не закрывает свой файловый обработчик сам
+        if isinstance(handler, MemoryHandler) and handler.target is not None:
+            handler.target.close()
 
-    # Добавляем файловый обработчик
+    # Добавляем файловый обработчик. Записи накапливаются в памяти и пишутся
+    # в файл пачками: при заполнении буфера, на ошибках и при выходе
     file_handler = logging.FileHandler(
         LOG_FILE, encoding='utf-8', mode='w')
     file_handler.setFormatter(logging.Formatter(log_format))
+    memory_handler = MemoryHandler(
+        LOG_BUFFER_CAPACITY, flushLevel=logging.ERROR, target=file_handler)
+    atexit.register(memory_handler.flush)
 
     # Добавляем консольный обработчик
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(logging.Formatter(log_format))
 
-    logger.addHandler(file_handler)
+    logger.addHandler(memory_handler)
     logger.addHandler(stream_handler)
+    logger._configured = True
 
     return logger
 
 
+def flush_logs():
+    """Записывает накопленные сообщения лога в файл"""
+    for handler in logging.getLogger('packer').handlers:
+        handler.flush()
+
+
 logger = logging.getLogger('packer')
@@ -30,6 +30,23 @@ DETAILS_REQUIRED_COLUMNS = [
     'f_short'
 ]
 
+# Явные типы колонок при чтении CSV, чтобы pandas не определял их сам.
+# Размеры и количества не фиксируются: некорректные значения в них
+# приводятся к числам в preprocess_dataframes, а целые размеры должны
+# оставаться целыми в подписях DXF.
+DETAILS_CSV_DTYPES = {
+    'order_id': str,
+    'bevel_type': str,
+    'milling_type': str,
+    'thickness_mm': float,
+    'material': str
+}
+
+MATERIALS_CSV_DTYPES = {
+    'thickness_mm': float,
+    'material': str
+}
+
 # Определение типа материала
 
 
@@ -44,6 +61,30 @@ DEFAULT_TRIM = 6  # мм
 DEFAULT_MARGIN = 6  # мм
 DEFAULT_KERF = 4  # мм
 
+# Минимальное количество деталей, начиная с которого комбинации
+# материал/толщина упаковываются в отдельных процессах: запуск процессов
+# занимает заметное время и окупается только на больших заказах
+PARALLEL_PACKING_MIN_DETAILS = 500
+
+# Количество деталей, начиная с которого сортировка выполняется через NumPy:
+# на меньших списках обычная сортировка кортежей быстрее
+NUMPY_SORT_MIN_RECTS = 256
+
+# Количество потоков для записи DXF файлов: пока один файл пишется на диск,
+# строится следующая карта раскроя
+DXF_SAVE_WORKERS = 4
+
+# Максимальное количество строк в окне логов
+MAX_LOG_LINES = 5000
+
+# Интервал переноса накопленного вывода в окно логов (мс)
+LOG_FLUSH_INTERVAL = 50
+
+# Задержка проверки путей после ввода с клавиатуры (мс) и время,
+# в течение которого результат проверки пути считается актуальным (с)
+PATH_CHECK_DELAY = 500
+PATH_STAT_TTL = 0.5
+
 
 # Поддерживаемые кодировки
 SUPPORTED_ENCODINGS = ['utf-8', 'utf-8-sig', 'windows-1251']
@@ -1,9 +1,16 @@
 import ezdxf
 from ezdxf.filemanagement import new
+import logging
 import re
 import os.path
+import numpy as np
 from .config import logger
 
+# Символы, недопустимые в именах слоев: всё, кроме букв, цифр и '_-.$ '
+_LAYER_NAME_INVALID = re.compile(r'[^\w\-.$ ]')
+# Символы, недопустимые в именах слоев фасок: всё, кроме букв, цифр и '_-./$'
+_BEVEL_LAYER_NAME_INVALID = re.compile(r'[^\w\-./$]')
+
 
 def normalize_layer_name(name):
     """
@@ -24,14 +31,9 @@ def normalize_layer_name(name):
 
     # Заменяем только безусловно недопустимые для DXF символы
     # Сохраняем больше символов, включая не-ASCII символы, если это возможно
-    safe_name = ""
-    for char in name:
-        # Разрешаем буквы, цифры, подчеркивания, дефисы, точки, доллары
-        if char.isalnum() or char in '_-.$ ':
-            safe_name += char
-        else:
-            # Для других символов используем подчеркивание
-            safe_name += '_'
+    # Разрешаем буквы, цифры, подчеркивания, дефисы, точки, доллары,
+    # для других символов используем подчеркивание
+    safe_name = _LAYER_NAME_INVALID.sub('_', name)
 
     # Проверяем, что имя не пустое после очистки
     if not safe_name or safe_name.isspace():
@@ -75,20 +77,15 @@ def add_bevel_lines(msp, x, y, length, width, bevel_type, f_long=0, f_short=0, b
             f"Смещение фаски не указано для {bevel_type}, используется {offset}")
     else:
         offset = bevel_offset
-        logger.info(f"Используется смещение фаски из таблицы: {offset}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Используется смещение фаски из таблицы: {offset}")
 
     # Работаем с исходным типом фаски, сохраняя кириллицу
     original_layer_name = bevel_type
 
     # Создаем безопасное имя слоя, которое будет работать в DXF
-    safe_layer_name = ''
-    for char in original_layer_name:
-        if ord(char) == 0xFFFD:
-            safe_layer_name += '_'
-        elif char.isalnum() or char.isalpha() or char in '_-./$':
-            safe_layer_name += char
-        else:
-            safe_layer_name += '_'
+    # (символ замены U+FFFD не является буквой и тоже заменяется)
+    safe_layer_name = _BEVEL_LAYER_NAME_INVALID.sub('_', original_layer_name)
 
     if not safe_layer_name or safe_layer_name.isspace():
         safe_layer_name = "BEVEL_TYPE"
@@ -216,8 +213,8 @@ def add_bevel_lines(msp, x, y, length, width, bevel_type, f_long=0, f_short=0, b
             ]
 
             msp.add_lwpolyline(points, dxfattribs=layer_attributes)
-            logger.info(
-                f"Добавлена замкнутая полилиния фаски по всему периметру")
+            logger.debug(
+                "Добавлена замкнутая полилиния фаски по всему периметру")
             return  # Выходим из функции, так как фаска уже нарисована
 
         if is_rotated:
@@ -409,6 +406,8 @@ def add_details_list(msp, sheet_width, details_list, filename=None):
                 details_list, key=lambda x: int(x[0]) if x and x[0] else 0)
 
             # Добавляем каждую деталь отдельной строкой
+            debug = logger.isEnabledFor(logging.DEBUG)
+            add_text = msp.add_text
             for i, detail_info in enumerate(sorted_details):
                 if not detail_info or len(detail_info) < 3:
                     continue
@@ -417,17 +416,16 @@ def add_details_list(msp, sheet_width, details_list, filename=None):
                 # Формируем текст по указанному формату
                 text = f"part_{part_id}_{order_id}_{size}"
 
-                # Создаем текст
-                text_entity = msp.add_text(text)
-                text_entity.dxf.layer = 'PARTSLIST'
-                text_entity.dxf.color = 3  # Зеленый
-                text_entity.dxf.height = 40
-
-                # Устанавливаем положение с учетом высоты строки
-                text_entity.dxf.insert = (
-                    0, -line_height * (line_index + i + 1))
+                # Создаем текст (зеленый) с положением с учетом высоты строки
+                add_text(text, dxfattribs={
+                    'layer': 'PARTSLIST',
+                    'color': 3,
+                    'height': 40,
+                    'insert': (0, -line_height * (line_index + i + 1))
+                })
 
-                logger.info(f"Добавлена запись в список деталей: {text}")
+                if debug:
+                    logger.debug(f"Добавлена запись в список деталей: {text}")
 
     except Exception as e:
         logger.error(f"Ошибка при добавлении списка деталей: {str(e)}")
@@ -494,21 +492,24 @@ def add_detail_dimensions(msp, x, y, width, height, part_id, order_id, thickness
     is_vertical = height > width
 
     try:
-        # Создаем текст с соответствующими атрибутами
-        text_entity = msp.add_text(text)
-        text_entity.dxf.layer = 'TEXT'
-        text_entity.dxf.color = 1  # Красный
-        text_entity.dxf.height = 40
-
         # Устанавливаем положение и поворот в зависимости от ориентации детали
         if is_vertical:
             # Для вертикальной детали - поворот на 90° и размещение в правом нижнем углу
-            text_entity.dxf.insert = (x + width - margin, y + margin)
-            text_entity.dxf.rotation = 90
+            insert = (x + width - margin, y + margin)
+            rotation = 90
         else:
             # Для горизонтальной детали - без поворота, в левом нижнем углу
-            text_entity.dxf.insert = (x + margin, y + margin)
-            text_entity.dxf.rotation = 0
+            insert = (x + margin, y + margin)
+            rotation = 0
+
+        # Создаем текст сразу со всеми атрибутами (красный, высота 40)
+        msp.add_text(text, dxfattribs={
+            'layer': 'TEXT',
+            'color': 1,
+            'height': 40,
+            'insert': insert,
+            'rotation': rotation
+        })
     except Exception as e:
         logger.error(f"Ошибка при добавлении текста: {str(e)}")
 
@@ -567,115 +568,191 @@ def add_cut_line(msp, x, y, width, height, offset):
         logger.error(f"Ошибка при добавлении линии реза: {str(e)}")
 
 
+def rect_outline_vertices(x, y, width, height, offset=0.0):
+    """
+    Строит замкнутые контуры прямоугольников для всех деталей сразу
+
+    Args:
+        x, y: массивы координат левых нижних углов
+        width, height: массивы размеров прямоугольников
+        offset: смещение контура наружу (мм)
+
+    Returns:
+        np.ndarray: массив вершин формы (N, 5, 2) - четыре угла и замыкающая точка
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    right = x + width + offset
+    top = y + height + offset
+    left = x - offset
+    bottom = y - offset
+    return np.stack([left, bottom, right, bottom, right, top,
+                     left, top, left, bottom], axis=1).reshape(-1, 5, 2)
+
+
 def add_detail_to_sheet(msp, detail, rect_info, kerf):
     """
     Добавляет деталь на лист
 
     Args:
         msp: modelspace DXF документа
-        detail: данные детали (DataFrame row)
+        detail: данные детали (строка DataFrame или словарь с теми же ключами)
         rect_info: информация о расположении детали на листе {'x', 'y', 'width', 'height', 'rotated'}
         kerf: диаметр фрезы, создающий отступ между деталями (мм)
 
     Returns:
         tuple: (part_id, order_id, size_str) - информация о детали для списка деталей
     """
-    try:
-        logger.info(f"Добавление детали: {detail['part_id']}")
-        part_id = str(detail['part_id'])
+    return add_details_to_sheet(msp, [(detail, rect_info)], kerf)[0]
 
-        # Оригинальные размеры детали из таблицы
-        orig_length = detail['length_mm']  # Длина (всегда большая сторона)
-        orig_width = detail['width_mm']    # Ширина (всегда меньшая сторона)
 
-        # Координаты левого нижнего угла детали
-        detail_x = rect_info['x']
-        detail_y = rect_info['y']
-
-        # Проверяем, есть ли прямое указание о повороте детали
-        is_rotated = rect_info.get('rotated', False)
+def add_details_to_sheet(msp, placements, kerf):
+    """
+    Добавляет на лист все детали контейнера за один проход.
+    Атрибуты слоев и методы modelspace подготавливаются один раз на весь лист.
 
-        logger.info(f"Деталь {part_id}: is_rotated={is_rotated}, " +
-                    f"оригинальные размеры: {orig_length}x{orig_width}")
+    Args:
+        msp: modelspace DXF документа
+        placements: последовательность пар (detail, rect_info), где detail - данные
+            детали (строка DataFrame или словарь), rect_info - расположение детали
+            на листе {'x', 'y', 'width', 'height', 'rotated'}
+        kerf: диаметр фрезы, создающий отступ между деталями (мм)
 
-        # Размеры детали для отрисовки
-        if is_rotated:
-            # Деталь повернута - меняем ширину и высоту местами
-            detail_width = orig_width
-            detail_height = orig_length
-            logger.info(
-                f"Деталь {part_id} повернута, отрисовка с размерами: {detail_width}x{detail_height}")
-        else:
-            # Деталь не повернута - используем оригинальные размеры
-            detail_width = orig_length
-            detail_height = orig_width
-            logger.info(
-                f"Деталь {part_id} не повернута, отрисовка с размерами: {detail_width}x{detail_height}")
+    Returns:
+        list: информация о деталях (part_id, order_id, size_str) в порядке placements,
+            None для деталей, которые не удалось добавить
+    """
+    # Подробные сообщения по каждой детали формируем только при уровне DEBUG
+    debug = logger.isEnabledFor(logging.DEBUG)
+    add_lwpolyline = msp.add_lwpolyline
+    details_attribs = {'layer': 'details'}
+    cut_attribs = {'layer': 'cut', 'color': 3}
+    # Линия реза смещена от контура на половину kerf
+    cut_offset = kerf / 2
+
+    # Геометрия всех деталей листа: у повернутой детали длина и ширина
+    # меняются местами. Для некорректных деталей остаются NaN - ошибка
+    # будет записана в лог при их отрисовке
+    geometry = np.full((len(placements), 4), np.nan)
+    for i, (detail, rect_info) in enumerate(placements):
+        try:
+            if rect_info.get('rotated', False):
+                geometry[i] = (rect_info['x'], rect_info['y'],
+                               detail['width_mm'], detail['length_mm'])
+            else:
+                geometry[i] = (rect_info['x'], rect_info['y'],
+                               detail['length_mm'], detail['width_mm'])
+        except (KeyError, TypeError, ValueError):
+            pass
+    xs, ys, widths, heights = geometry.T
+
+    # Контуры деталей и линии реза строятся одним набором операций NumPy
+    outlines = rect_outline_vertices(xs, ys, widths, heights).tolist()
+    cut_lines = rect_outline_vertices(
+        xs, ys, widths, heights, cut_offset).tolist()
+
+    results = []
+    for i, (detail, rect_info) in enumerate(placements):
+        try:
+            part_id = str(detail['part_id'])
+            if debug:
+                logger.debug(f"Добавление детали: {part_id}")
+
+            # Оригинальные размеры детали из таблицы
+            orig_length = detail['length_mm']  # Длина (всегда большая сторона)
+            orig_width = detail['width_mm']    # Ширина (всегда меньшая сторона)
+
+            # Координаты левого нижнего угла детали
+            detail_x = rect_info['x']
+            detail_y = rect_info['y']
+
+            # Проверяем, есть ли прямое указание о повороте детали
+            is_rotated = rect_info.get('rotated', False)
+
+            if debug:
+                logger.debug(f"Деталь {part_id}: is_rotated={is_rotated}, " +
+                             f"оригинальные размеры: {orig_length}x{orig_width}")
+
+            # Размеры детали для отрисовки
+            if is_rotated:
+                # Деталь повернута - меняем ширину и высоту местами
+                detail_width = orig_width
+                detail_height = orig_length
+                if debug:
+                    logger.debug(
+                        f"Деталь {part_id} повернута, отрисовка с размерами: {detail_width}x{detail_height}")
+            else:
+                # Деталь не повернута - используем оригинальные размеры
+                detail_width = orig_length
+                detail_height = orig_width
+                if debug:
+                    logger.debug(
+                        f"Деталь {part_id} не повернута, отрисовка с размерами: {detail_width}x{detail_height}")
+
+            if np.isnan(geometry[i]).any():
+                raise ValueError(
+                    f"некорректные координаты или размеры: {detail_x}, {detail_y}, "
+                    f"{detail_width}x{detail_height}")
+
+            # Добавляем контур детали и линию реза со смещением (половина kerf)
+            add_lwpolyline(outlines[i], dxfattribs=details_attribs)
+            add_lwpolyline(cut_lines[i], dxfattribs=cut_attribs)
+
+            # Добавляем фаски, если нужно
+            # Гарантируем, что тип фаски - строка
+            bevel_type = str(detail.get('bevel_type', '')) if detail.get(
+                'bevel_type') is not None else ''
+
+            # Получаем смещение фаски из таблицы, если оно указано
+            bevel_offset = None
+            if 'bevel_offset_mm' in detail and detail['bevel_offset_mm'] is not None:
+                try:
+                    bevel_offset = float(detail['bevel_offset_mm'])
+                    if debug:
+                        logger.debug(
+                            f"Используется смещение фаски из таблицы: {bevel_offset}")
+                except (ValueError, TypeError):
+                    logger.warning(
+                        f"Некорректное значение смещения фаски: {detail['bevel_offset_mm']}")
+
+            # Получаем значения фасок по длине и ширине
+            f_long = int(detail.get('f_long', 0)) if detail.get(
+                'f_long') is not None else 0
+            f_short = int(detail.get('f_short', 0)) if detail.get(
+                'f_short') is not None else 0
+
+            if bevel_type and bevel_type.lower() not in ['нет', 'none', 'no']:
+                # Добавляем фаски с учетом поворота детали
+                add_bevel_lines(msp, detail_x, detail_y, detail_width, detail_height,
+                                bevel_type, f_long, f_short, bevel_offset, is_rotated)
+
+            # Добавляем размеры и метки
+            if debug:
+                logger.debug(
+                    f"Добавление текста для детали {part_id}, координаты: {detail_x}, {detail_y}")
+            order_id = detail.get('order_id', None)
+            thickness = detail.get('thickness_mm', None)
+            material = detail.get('material', 'S')
+
+            # Форматируем толщину с материалом для отображения
+            thickness_display = f"{thickness}{material}" if material and material != 'S' else str(
+                thickness)
+
+            add_detail_dimensions(msp, detail_x, detail_y, detail_width, detail_height,
+                                  part_id, order_id, thickness_display)
+
+            # Информация о детали для последующего использования в списке деталей
+            size_str = f"{orig_length}x{orig_width}"
+            results.append((part_id, order_id, size_str))
 
-        # Добавляем контур детали
-        msp.add_lwpolyline([
-            (detail_x, detail_y),
-            (detail_x + detail_width, detail_y),
-            (detail_x + detail_width, detail_y + detail_height),
-            (detail_x, detail_y + detail_height),
-            (detail_x, detail_y)
-        ], dxfattribs={'layer': 'details'})
-
-        # Добавляем линию реза со смещением 2мм (половина kerf)
-        add_cut_line(msp, detail_x, detail_y,
-                     detail_width, detail_height, kerf/2)
-
-        # Добавляем фаски, если нужно
-        # Гарантируем, что тип фаски - строка
-        bevel_type = str(detail.get('bevel_type', '')) if detail.get(
-            'bevel_type') is not None else ''
-
-        # Получаем смещение фаски из таблицы, если оно указано
-        bevel_offset = None
-        if 'bevel_offset_mm' in detail and detail['bevel_offset_mm'] is not None:
-            try:
-                bevel_offset = float(detail['bevel_offset_mm'])
-                logger.info(
-                    f"Используется смещение фаски из таблицы: {bevel_offset}")
-            except (ValueError, TypeError):
-                logger.warning(
-                    f"Некорректное значение смещения фаски: {detail['bevel_offset_mm']}")
-
-        # Получаем значения фасок по длине и ширине
-        f_long = int(detail.get('f_long', 0)) if detail.get(
-            'f_long') is not None else 0
-        f_short = int(detail.get('f_short', 0)) if detail.get(
-            'f_short') is not None else 0
-
-        if bevel_type and bevel_type.lower() not in ['нет', 'none', 'no']:
-            # Добавляем фаски с учетом поворота детали
-            add_bevel_lines(msp, detail_x, detail_y, detail_width, detail_height,
-                            bevel_type, f_long, f_short, bevel_offset, is_rotated)
-
-        # Добавляем размеры и метки
-        logger.info(
-            f"Добавление текста для детали {part_id}, координаты: {detail_x}, {detail_y}")
-        order_id = detail.get('order_id', None)
-        thickness = detail.get('thickness_mm', None)
-        material = detail.get('material', 'S')
-
-        # Форматируем толщину с материалом для отображения
-        thickness_display = f"{thickness}{material}" if material and material != 'S' else str(
-            thickness)
-
-        add_detail_dimensions(msp, detail_x, detail_y, detail_width, detail_height,
-                              part_id, order_id, thickness_display)
-
-        # Возвращаем информацию о детали для последующего использования в списке деталей
-        size_str = f"{orig_length}x{orig_width}"
-        return part_id, order_id, size_str
+        except Exception as e:
+            logger.error(
+                f"Ошибка при добавлении детали {detail.get('part_id', 'unknown')}: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            results.append(None)
 
-    except Exception as e:
-        logger.error(
-            f"Ошибка при добавлении детали {detail.get('part_id', 'unknown')}: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return None
+    return results
 
 
 # Заглушка для работы с узорами - просто заглушка, не выполняет никаких действий
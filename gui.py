@@ -1,22 +1,30 @@
+import logging
 import os
+import stat
 import sys
+import time
+import traceback
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import pandas as pd
 import threading
 import numpy as np
+from collections import deque
+from dataclasses import dataclass
 
-from packer.config import logger, setup_logging
+from packer.config import logger, setup_logging, flush_logs, LOG_FORMAT
 from packer.constants import (
     MATERIALS_REQUIRED_COLUMNS,
     DETAILS_REQUIRED_COLUMNS,
     DEFAULT_MARGIN,
     DEFAULT_KERF,
-    SUPPORTED_ENCODINGS
+    SUPPORTED_ENCODINGS,
+    MAX_LOG_LINES,
+    LOG_FLUSH_INTERVAL,
+    PATH_CHECK_DELAY,
+    PATH_STAT_TTL
 )
 from packer.cleanup import CleanupManager
 from packer.remnants import RemnantsManager
-from packer.packing import pack_and_generate_dxf
 from packer.utils import (
     set_log_level,
     read_csv_files,
@@ -25,6 +33,37 @@ from packer.utils import (
     check_critical_values
 )
 
+# Числовые типы ключей материалов (толщина без указания материала)
+_NUMERIC = (int, float, np.integer, np.floating)
+
+
+@dataclass(frozen=True)
+class RunParams:
+    """Параметры запуска раскроя, снятые с интерфейса один раз"""
+    details_path: str
+    materials_path: str
+    pattern_dir: str
+    output_dir: str
+    margin: int
+    kerf: int
+    keep_files: bool
+
+
+class TkLogHandler(logging.Handler):
+    """Обработчик логов, накапливающий сообщения для окна логов"""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self.buffer = buffer
+
+    def emit(self, record):
+        # Вызывается из любого потока, поэтому только накапливаем
+        # текст; в виджет его переносит flush_log в потоке Tk
+        try:
+            self.buffer.append(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
 
 class CuttingAppGUI:
     """Графический интерфейс приложения"""
@@ -39,6 +78,10 @@ class CuttingAppGUI:
         self.remnants_manager = RemnantsManager()
         self.cutting_thread = None  # Атрибут для хранения потока
 
+        # Кэш проверок путей: путь -> (время проверки, st_mode или None)
+        self._stat_cache = {}
+        self._path_check_id = None  # Отложенная проверка после ввода пути
+
         # Пути по умолчанию
         if getattr(sys, 'frozen', False):
             # Работаем из EXE
@@ -61,28 +104,51 @@ class CuttingAppGUI:
         self.create_log_frame()
         self.create_action_frame()
 
+        self.setup_log_redirect()
+
         # Проверяем наличие файлов
         self.check_files()
-        self.setup_log_redirect()
 
         # Добавим метод проверки возможности активации кнопки
         self.check_run_button_state()
 
     def setup_log_redirect(self):
-        """Перенаправляет вывод в текстовый виджет"""
-        class TextRedirector:
-            def __init__(self, widget):
-                self.widget = widget
-
-            def write(self, text):
-                self.widget.insert(tk.END, text)
-                self.widget.see(tk.END)
-
-            def flush(self):
-                pass
-
-        sys.stdout = TextRedirector(self.log_text)
-        sys.stderr = TextRedirector(self.log_text)
+        """Направляет сообщения логгера в текстовый виджет"""
+        self.log_buffer = deque()
+        self.log_handler = TkLogHandler(self.log_buffer)
+        self.log_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(self.log_handler)
+
+        # Метка конца лога: с правой гравитацией остается после вставляемого
+        # текста, поэтому прокрутка к ней не требует пересчета индекса END
+        self.log_text.mark_set('logend', tk.END)
+        self.log_text.mark_gravity('logend', tk.RIGHT)
+        self.root.after(LOG_FLUSH_INTERVAL, self.flush_log)
+
+    def flush_log(self):
+        """Переносит накопленный вывод в окно логов одной вставкой"""
+        if self.log_buffer:
+            # Забираем ровно столько фрагментов, сколько есть сейчас,
+            # чтобы не потерять текст, дописанный другим потоком
+            chunks = [self.log_buffer.popleft()
+                      for _ in range(len(self.log_buffer))]
+
+            # Прокручиваем только если пользователь не листал лог вверх
+            at_end = self.log_text.yview()[1] >= 1.0
+            self.log_text.config(state="normal")
+            self.log_text.insert('logend', ''.join(chunks))
+
+            # Ограничиваем размер лога, удаляя самые старые строки
+            lines = int(self.log_text.index('end-1c').split('.')[0])
+            if lines > MAX_LOG_LINES:
+                self.log_text.delete('1.0', f'{lines - MAX_LOG_LINES + 1}.0')
+            self.log_text.config(state="disabled")
+
+            # Прокручиваем один раз за перенос, а не на каждое сообщение
+            if at_end:
+                self.log_text.see('logend')
+
+        self.root.after(LOG_FLUSH_INTERVAL, self.flush_log)
 
     def create_input_frame(self):
         """Создает фрейм для ввода путей к файлам"""
@@ -127,6 +193,11 @@ class CuttingAppGUI:
         ttk.Button(frame, text="Обзор", command=self.select_output_dir).grid(
             row=3, column=2, padx=5, pady=2)
 
+        # При ручном вводе путей проверяем их не на каждое нажатие клавиши
+        for entry in (self.details_entry, self.materials_entry,
+                      self.pattern_dir_entry, self.output_dir_entry):
+            entry.bind("<KeyRelease>", self.schedule_run_button_check)
+
         frame.columnconfigure(1, weight=1)
 
     def create_options_frame(self):
@@ -158,8 +229,11 @@ class CuttingAppGUI:
         frame = ttk.LabelFrame(self.root, text="Логи")
         frame.pack(fill="both", expand=True, padx=10, pady=5)
 
-        # Текстовое поле для логов
-        self.log_text = tk.Text(frame, height=10, wrap="word")
+        # Текстовое поле для логов: без переноса строк и истории отмены,
+        # чтобы частые вставки не пересчитывали перенос и не копили undo.
+        # Поле только для чтения - текст добавляется в flush_log
+        self.log_text = tk.Text(frame, height=10, wrap="none", undo=False,
+                                autoseparators=False, maxundo=0, state="disabled")
         self.log_text.pack(fill="both", expand=True, padx=5, pady=5)
 
         # Прокрутка для логов
@@ -168,6 +242,12 @@ class CuttingAppGUI:
         scrollbar.pack(side="right", fill="y")
         self.log_text.config(yscrollcommand=scrollbar.set)
 
+        # Горизонтальная прокрутка для длинных строк
+        xscrollbar = ttk.Scrollbar(
+            frame, orient="horizontal", command=self.log_text.xview)
+        xscrollbar.pack(side="bottom", fill="x")
+        self.log_text.config(xscrollcommand=xscrollbar.set)
+
     def create_action_frame(self):
         """Создает фрейм для кнопок действий"""
         frame = ttk.Frame(self.root)
@@ -199,6 +279,11 @@ class CuttingAppGUI:
         self.status_label = ttk.Label(frame, text="Инициализация...")
         self.status_label.pack(side="right", padx=5)
 
+        # Индикатор выполнения раскроя
+        self.progress = ttk.Progressbar(
+            frame, mode="indeterminate", length=120)
+        self.progress.pack(side="right", padx=5)
+
     def select_details_file(self):
         """Выбор файла деталей"""
         filename = filedialog.askopenfilename(
@@ -239,8 +324,43 @@ class CuttingAppGUI:
             self.output_dir_entry.insert(0, dirname)
             self.check_run_button_state()  # Проверяем состояние после выбора
 
+    def schedule_run_button_check(self, event=None):
+        """Откладывает проверку путей до паузы во вводе"""
+        if self._path_check_id is not None:
+            self.root.after_cancel(self._path_check_id)
+        self._path_check_id = self.root.after(
+            PATH_CHECK_DELAY, self.check_run_button_state)
+
+    def _exists(self, path, is_dir):
+        """
+        Проверяет наличие файла или директории с кэшированием результата.
+
+        Args:
+            path: путь для проверки
+            is_dir: True - ожидается директория, False - файл
+
+        Returns:
+            bool: True если путь существует и имеет нужный тип
+        """
+        now = time.monotonic()
+        cached = self._stat_cache.get(path)
+        if cached is not None and now - cached[0] < PATH_STAT_TTL:
+            mode = cached[1]
+        else:
+            # Один вызов stat вместо отдельных isfile/isdir
+            try:
+                mode = os.stat(path).st_mode
+            except (OSError, ValueError):
+                mode = None
+            self._stat_cache[path] = (now, mode)
+
+        if mode is None:
+            return False
+        return stat.S_ISDIR(mode) if is_dir else stat.S_ISREG(mode)
+
     def check_run_button_state(self):
         """Проверяет возможность активации кнопки раскроя"""
+        self._path_check_id = None
         try:
             details_path = self.details_entry.get()
             materials_path = self.materials_entry.get()
@@ -248,10 +368,10 @@ class CuttingAppGUI:
             output_dir = self.output_dir_entry.get()
 
             # Проверяем наличие всех необходимых файлов и директорий
-            if (os.path.isfile(details_path) and
-                os.path.isfile(materials_path) and
-                os.path.isdir(pattern_dir) and
-                    os.path.isdir(output_dir)):
+            if (self._exists(details_path, is_dir=False) and
+                self._exists(materials_path, is_dir=False) and
+                self._exists(pattern_dir, is_dir=True) and
+                    self._exists(output_dir, is_dir=True)):
                 self.run_button.config(state="normal")
             else:
                 self.run_button.config(state="disabled")
@@ -259,26 +379,69 @@ class CuttingAppGUI:
             logger.error(f"Ошибка при проверке состояния кнопки: {e}")
             self.run_button.config(state="disabled")
 
+    @staticmethod
+    def _existing_paths(paths):
+        """
+        Проверяет наличие путей, читая каждую родительскую директорию один раз.
+
+        Args:
+            paths: список путей
+
+        Returns:
+            set: пути из списка, которые существуют
+        """
+        # Группируем пути по родительской директории
+        by_parent = {}
+        existing = set()
+        for path in paths:
+            if not path:
+                continue
+            full_path = os.path.normpath(os.path.abspath(path))
+            parent, name = os.path.split(full_path)
+            if not name:
+                # Корень диска проверяем напрямую
+                if os.path.exists(full_path):
+                    existing.add(path)
+                continue
+            # normcase - на Windows имена файлов сравниваются без учета регистра
+            by_parent.setdefault(parent, []).append((path, os.path.normcase(name)))
+
+        for parent, items in by_parent.items():
+            try:
+                with os.scandir(parent) as it:
+                    names = {os.path.normcase(entry.name) for entry in it}
+            except OSError:
+                # Родительская директория отсутствует или недоступна
+                existing.update(path for path, _ in items if os.path.exists(path))
+                continue
+            existing.update(path for path, name in items if name in names)
+        return existing
+
     def check_files(self):
         """Проверяет наличие необходимых файлов"""
         self.details_path = self.details_entry.get()
         self.materials_path = self.materials_entry.get()
         self.pattern_dir = self.pattern_dir_entry.get()
+        self.output_dir = self.output_dir_entry.get()
+
+        # Обычно все пути лежат в одной папке - читаем её один раз
+        existing = self._existing_paths(
+            [self.details_path, self.materials_path, self.pattern_dir, self.output_dir])
 
         files_ok = True
 
         # Проверка файла деталей
-        if not os.path.exists(self.details_path):
+        if self.details_path not in existing:
             logger.warning(f"Файл деталей не найден: {self.details_path}")
             files_ok = False
 
         # Проверка файла материалов
-        if not os.path.exists(self.materials_path):
+        if self.materials_path not in existing:
             logger.warning(f"Файл материалов не найден: {self.materials_path}")
             files_ok = False
 
         # Проверка директории узоров
-        if not os.path.exists(self.pattern_dir):
+        if self.pattern_dir not in existing:
             logger.warning(
                 f"Папка с узорами не найдена: {self.pattern_dir}, будет создана")
             try:
@@ -288,8 +451,7 @@ class CuttingAppGUI:
                 logger.error(f"Не удалось создать директорию: {str(e)}")
 
         # Проверка директории вывода
-        self.output_dir = self.output_dir_entry.get()
-        if not os.path.exists(self.output_dir):
+        if self.output_dir not in existing:
             logger.warning(
                 f"Папка для выходных файлов не найдена: {self.output_dir}, будет создана")
             try:
@@ -318,45 +480,64 @@ class CuttingAppGUI:
 
     def clear_logs(self):
         """Очищает логи"""
+        self.log_text.config(state="normal")
         self.log_text.delete(1.0, tk.END)
+        self.log_text.config(state="disabled")
         self.cleanup_manager.cleanup_logs()
         logger.info("Логи очищены")
 
     def clear_all(self):
         """Очищает все временные файлы и логи"""
+        self.log_text.config(state="normal")
         self.log_text.delete(1.0, tk.END)
+        self.log_text.config(state="disabled")
         self.cleanup_manager.cleanup_all(keep_output=False)
         logger.info("Все временные файлы и логи очищены")
         self.check_files()
 
     def run_cutting(self):
         """Запускает процесс раскроя в отдельном потоке"""
+        # Получаем параметры из интерфейса в потоке Tk: поток раскроя
+        # работает со снимком и не зависит от правок полей во время работы
+        try:
+            params = RunParams(
+                details_path=self.details_entry.get(),
+                materials_path=self.materials_entry.get(),
+                pattern_dir=self.pattern_dir_entry.get(),
+                output_dir=self.output_dir_entry.get(),
+                margin=int(self.margin_var.get()),
+                kerf=int(self.kerf_var.get()),
+                keep_files=bool(self.keep_files_var.get()))
+        except (tk.TclError, ValueError) as e:
+            logger.error(f"Некорректные параметры раскроя: {str(e)}")
+            messagebox.showerror(
+                "Ошибка", f"Некорректные параметры раскроя: {str(e)}")
+            return
+
         self.run_button.config(state="disabled")
         self.status_label.config(text="Выполняется раскрой...")
+        self.progress.start(50)
         self.cutting_thread = threading.Thread(
-            target=self._cutting_thread, daemon=True)
+            target=self._cutting_thread, args=(params,), daemon=True)
         self.cutting_thread.start()
 
-    def _cutting_thread(self):
-        """Поток для выполнения раскроя"""
+    def _cutting_thread(self, params):
+        """
+        Поток для выполнения раскроя
+
+        Args:
+            params: параметры запуска RunParams
+        """
         try:
             logger.info("Начинается процесс раскроя")
 
-            # Получаем параметры из интерфейса
-            details_path = self.details_entry.get()
-            materials_path = self.materials_entry.get()
-            pattern_dir = self.pattern_dir_entry.get()
-            output_dir = self.output_dir_entry.get()
-            margin = self.margin_var.get()
-            kerf = self.kerf_var.get()
-
-            # Создаем менеджер остатков
-            remnants_manager = RemnantsManager(
-                margin=int(margin), kerf=int(kerf))
+            # Передаем параметры менеджеру остатков приложения
+            remnants_manager = self.remnants_manager
+            remnants_manager.set_params(params.margin, params.kerf)
 
             # Читаем CSV файлы
             details_df, materials_df = read_csv_files(
-                details_path, materials_path, SUPPORTED_ENCODINGS)
+                params.details_path, params.materials_path, SUPPORTED_ENCODINGS)
 
             if details_df is None or materials_df is None:
                 logger.error("Не удалось прочитать CSV-файлы!")
@@ -398,26 +579,29 @@ class CuttingAppGUI:
                 self.root.after(0, self._finish_cutting_thread)
                 return
 
-            # Переходим в директорию вывода
-            current_dir = os.getcwd()
-            os.chdir(output_dir)
+            # Запускаем раскрой. Модуль упаковки тянет за собой ezdxf и rectpack,
+            # поэтому импортируется при первом запуске, а не при открытии окна
+            from packer.packing import pack_and_generate_dxf
 
-            # Запускаем раскрой
             logger.info("Начинается процесс раскроя")
             packers_by_material, total_used_sheets, layout_count = pack_and_generate_dxf(
-                details_df, materials_df, pattern_dir, int(margin), int(kerf))
+                details_df, materials_df, params.pattern_dir, params.margin, params.kerf,
+                output_dir=params.output_dir)
 
-            # Обновляем таблицу материалов с учетом использованных листов и остатков
-            updated_materials_df = materials_df.copy()
+            # Изменения таблицы материалов собираем по всем комбинациям
+            # и применяем одним проходом после цикла
+            material_updates = []
+
+            # Первая строка листов для каждой комбинации толщина/материал,
+            # чтобы не просматривать всю таблицу заново для каждого ключа
+            first_sheets = materials_df.drop_duplicates(
+                ['thickness_mm', 'material']).set_index(['thickness_mm', 'material'])
 
             # Проходимся по всем упаковщикам
             for material_key, packer in packers_by_material.items():  # This line caused the error
                 try:
                     # Обрабатываем разные типы ключей (строка или число)
-                    if isinstance(material_key, (float, int)) or (
-                        hasattr(material_key, 'dtype') and
-                        isinstance(material_key.dtype, (np.float64, np.int64))
-                    ):
+                    if isinstance(material_key, _NUMERIC):
                         # Если ключ - число, то толщина = ключ, материал = 'S' по умолчанию
                         thickness = float(material_key)
                         material = 'S'
@@ -425,16 +609,17 @@ class CuttingAppGUI:
                             f"Обработка числового ключа: {material_key} -> толщина={thickness}, материал={material}")
                     else:
                         # Если ключ - строка, разбиваем его на толщину и материал
-                        key_parts = str(material_key).split('_', 1)
-                        if len(key_parts) != 2:
+                        key = str(material_key)
+                        idx = key.find('_')
+                        if idx < 0:
                             logger.warning(
                                 f"Некорректный ключ материала: {material_key}")
                             # Пробуем преобразовать в число
-                            thickness = float(material_key)
+                            thickness = float(key)
                             material = 'S'
                         else:
-                            thickness = float(key_parts[0])
-                            material = key_parts[1]
+                            thickness = float(key[:idx])
+                            material = key[idx + 1:]
 
                     if thickness <= 0:
                         logger.warning(
@@ -444,21 +629,17 @@ class CuttingAppGUI:
                     logger.info(
                         f"Обработка остатков для комбинации: толщина={thickness}, материал={material}")
 
-                    # Находим подходящие листы материала для этой комбинации
-                    material_mask = (materials_df['thickness_mm'] == thickness) & (
-                        materials_df['material'] == material)
-                    material_sheets = materials_df[material_mask]
-
-                    if material_sheets.empty:
+                    # Находим лист материала для этой комбинации
+                    try:
+                        material_sheet = first_sheets.loc[(thickness, material)]
+                    except KeyError:
                         logger.warning(
                             f"Не найдены материалы с комбинацией: толщина={thickness}, материал={material}")
                         continue
 
                     # Получаем размеры листа для этой комбинации
-                    sheet_length = float(
-                        material_sheets['sheet_length_mm'].iloc[0])
-                    sheet_width = float(
-                        material_sheets['sheet_width_mm'].iloc[0])
+                    sheet_length = float(material_sheet['sheet_length_mm'])
+                    sheet_width = float(material_sheet['sheet_width_mm'])
 
                     # Проверяем корректность размеров листа
                     if sheet_length <= 0 or sheet_width <= 0:
@@ -467,54 +648,59 @@ class CuttingAppGUI:
                         continue
 
                     # Рассчитываем количество использованных листов этой комбинации
-                    used_sheets = 0
-                    for bin_idx, bin_rects in enumerate(packer):
-                        if bin_rects:  # Если в контейнере есть прямоугольники
-                            used_sheets += 1
+                    # (учитываются только контейнеры, в которых есть прямоугольники)
+                    used_sheets = sum(1 for bin_rects in packer if bin_rects)
 
                     # Обновляем таблицу для этой комбинации
                     logger.info(
                         f"Обновление таблицы для комбинации: толщина={thickness}, материал={material}. Использовано листов: {used_sheets}")
-                    updated_materials_df = remnants_manager.update_material_table(
-                        updated_materials_df, packer, thickness, material, used_sheets,
+                    update = remnants_manager.calculate_material_update(
+                        materials_df, packer, thickness, material, used_sheets,
                         sheet_length, sheet_width)
+                    if update is not None:
+                        material_updates.append(update)
 
                 except Exception as e:
                     logger.error(
                         f"Ошибка при обработке остатков для ключа {material_key}: {str(e)}")
-                    import traceback
-                    logger.error(traceback.format_exc())
+                    # Трассировку формируем только при отладке: ошибка может
+                    # повторяться для каждого ключа
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Трассировка: {traceback.format_exc()}")
+
+            # Обновляем таблицу материалов с учетом использованных листов и остатков
+            updated_materials_df = remnants_manager.apply_material_updates(
+                materials_df, material_updates)
 
             # Сохраняем обновленную таблицу материалов
             remnants_manager.save_material_table(
-                updated_materials_df, os.path.join(output_dir, "updated_materials.csv"))
-
-            # Возвращаемся в исходную директорию
-            os.chdir(current_dir)
+                updated_materials_df, os.path.join(params.output_dir, "updated_materials.csv"))
 
             # Показываем результаты
             logger.info(f"Создано карт раскроя: {layout_count}")
 
             self.root.after(0, lambda: messagebox.showinfo("Готово",
                                                            f"Создано карт раскроя: {layout_count}\n"
-                                                           f"Обновлённый файл материалов: {os.path.join(output_dir, 'updated_materials.csv')}\n\n"
-                                                           f"Файлы сохранены в: {output_dir}"))
+                                                           f"Обновлённый файл материалов: {os.path.join(params.output_dir, 'updated_materials.csv')}\n\n"
+                                                           f"Файлы сохранены в: {params.output_dir}"))
 
             # Очищаем временные файлы если нужно
-            if not self.keep_files_var.get():
+            if not params.keep_files:
                 self.cleanup_manager.cleanup_all(keep_output=True)
 
         except Exception as e:
             logger.error(f"Ошибка при выполнении раскроя: {str(e)}")
-            import traceback
             logger.error(traceback.format_exc())
             self.root.after(0, lambda: messagebox.showerror(
                 "Ошибка", f"Ошибка при выполнении раскроя: {str(e)}"))
 
         finally:
+            # Сбрасываем накопленный лог в файл, чтобы он был полным после запуска
+            flush_logs()
             self.root.after(0, self._finish_cutting_thread)
 
     def _finish_cutting_thread(self):
         """Завершает процесс раскроя и обновляет интерфейс"""
+        self.progress.stop()
         self.run_button.config(state="normal")
         self.status_label.config(text="Готов к запуску")
@@ -1,5 +1,6 @@
 import os
 import sys
+import multiprocessing
 import tkinter as tk
 from packer.config import setup_logging
 from packer.gui import CuttingAppGUI
@@ -17,4 +18,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Нужно для упаковки в отдельных процессах из собранного EXE
+    multiprocessing.freeze_support()
     main()
@@ -1,11 +1,16 @@
 import os
-from rectpack import newPacker, MaxRectsBssf
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from rectpack import newPacker, MaxRectsBaf, MaxRectsBssf
 from .config import logger
 from .patterns import load_patterns
 from .dxf_generator import (
     create_new_dxf,
     add_sheet_outline,
-    add_detail_to_sheet,
+    add_details_to_sheet,
     add_layout_filename_title,
     add_details_list
 )
@@ -14,23 +19,42 @@ from .constants import (
     MATERIALS_REQUIRED_COLUMNS,
     DETAILS_REQUIRED_COLUMNS,
     DEFAULT_MARGIN,
-    DEFAULT_KERF
+    DEFAULT_KERF,
+    PARALLEL_PACKING_MIN_DETAILS,
+    NUMPY_SORT_MIN_RECTS,
+    DXF_SAVE_WORKERS
 )
 
 
 def hybrid_sort(rectangles):
     """Сортировка деталей для HybridMaxRects - сначала большие, потом средние, потом мелкие."""
-    large, medium, small = [], [], []
-    for w, h, idx in rectangles:
-        if w > 2000:
-            large.append((w, h, idx))
-        elif w < 800:
-            small.append((w, h, idx))
-        else:
-            medium.append((w, h, idx))
-    return (sorted(large, key=lambda x: -(x[0] * x[1])) +
-            sorted(medium, key=lambda x: -(x[0] * x[1])) +
-            sorted(small, key=lambda x: (-x[0], -x[1])))
+    if len(rectangles) < NUMPY_SORT_MIN_RECTS:
+        # Ключи считаются один раз, сравнение кортежей выполняется в C;
+        # позиция в конце сохраняет исходный порядок равных деталей
+        keyed = []
+        for pos, (w, h, _) in enumerate(rectangles):
+            if w > 2000:
+                keyed.append((0, -(w * h), 0, pos))
+            elif w < 800:
+                keyed.append((2, -w, -h, pos))
+            else:
+                keyed.append((1, -(w * h), 0, pos))
+        keyed.sort()
+        return [rectangles[key[3]] for key in keyed]
+
+    sizes = np.array([(w, h) for w, h, _ in rectangles], dtype=np.float64)
+    w, h = sizes[:, 0], sizes[:, 1]
+
+    # Группа: 0 - большие (w > 2000), 1 - средние, 2 - мелкие (w < 800)
+    bucket = np.where(w > 2000, 0, np.where(w < 800, 2, 1))
+    small = bucket == 2
+
+    # Большие и средние - по убыванию площади, мелкие - по убыванию w, затем h.
+    # lexsort устойчив, поэтому равные детали сохраняют исходный порядок
+    primary = np.where(small, -w, -(w * h))
+    secondary = np.where(small, -h, 0.0)
+    order = np.lexsort((secondary, primary, bucket))
+    return [rectangles[i] for i in order.tolist()]
 
 
 def format_remnant_id(remnant_id):
@@ -68,216 +92,264 @@ def format_remnant_id(remnant_id):
     return remnant_id
 
 
-def pack_and_generate_dxf(details_df, materials_df, pattern_dir="patterns", margin=DEFAULT_MARGIN, kerf=DEFAULT_KERF):
+def prepare_rectangles_for_packing(material_details, kerf=DEFAULT_KERF):
     """
-    Упаковывает детали и генерирует DXF файлы с приоритетом остатков.
-    Гарантирует сохранение оригинальных remnant_id при создании карт раскроя.
+    Готовит прямоугольники деталей для упаковки с учетом реза и количества.
 
     Args:
-        details_df: DataFrame с деталями
-        materials_df: DataFrame с материалами
-        pattern_dir: директория с узорами
-        margin: отступ от края листа (мм)
+        material_details: DataFrame с деталями (индекс 0..n-1)
         kerf: диаметр фрезы (мм)
 
     Returns:
-        tuple: (словарь упаковщиков, количество использованных листов, количество карт раскроя)
+        list: [(ширина, высота, индекс детали), ...], по одному на каждый экземпляр
     """
-    # Импортируем нужные алгоритмы из rectpack
-    from rectpack import MaxRectsBaf, MaxRectsBssf
-
-    print("Запуск упаковки с полным приоритетом остатков")
-    logger.info("Запуск упаковки с полным приоритетом остатков")
-
-    packers_by_material = {}
-    total_used_sheets = 0
-    remnants_manager = RemnantsManager(margin=margin, kerf=kerf)
-    current_materials_df = materials_df.copy()
-    layout_count = 0  # Подсчёт созданных карт раскроя
-
-    # Проверка наличия обязательных колонок
-    for col in MATERIALS_REQUIRED_COLUMNS:
-        if col not in current_materials_df.columns:
-            logger.error(f"Отсутствует колонка '{col}' в materials_df")
-            raise ValueError(f"Missing column '{col}' in materials_df")
-    for col in DETAILS_REQUIRED_COLUMNS:
-        if col not in details_df.columns:
-            logger.error(f"Отсутствует колонка '{col}' в details_df")
-            raise ValueError(f"Missing column '{col}' in details_df")
-
-    # Добавляем колонку remnant_id, если её нет в таблице материалов
-    if 'remnant_id' not in current_materials_df.columns:
-        current_materials_df['remnant_id'] = None
+    # Считаем размеры сразу по колонкам, без обхода строк
+    widths = material_details['length_mm'].to_numpy() + kerf
+    heights = material_details['width_mm'].to_numpy() + kerf
+    quantities = np.maximum(
+        material_details['quantity'].fillna(1).to_numpy().astype(np.int64), 1)
+
+    valid = (widths > 0) & (heights > 0)
+    for idx in np.flatnonzero(~valid):
         logger.info(
-            "Добавлена колонка 'remnant_id' со значением None для исходной таблицы материалов")
+            f"Пропуск детали {material_details['part_id'].iat[idx]}: некорректные размеры {widths[idx]}x{heights[idx]}")
 
-    unique_combinations = details_df[[
-        'thickness_mm', 'material']].drop_duplicates()
-    logger.info(
-        f"Найдено {len(unique_combinations)} комбинаций материалов/толщин")
+    # Каждый экземпляр детали - отдельный прямоугольник с индексом детали
+    indices = np.flatnonzero(valid)
+    quantities = quantities[valid]
+    return list(zip(np.repeat(widths[valid], quantities).tolist(),
+                    np.repeat(heights[valid], quantities).tolist(),
+                    np.repeat(indices, quantities).tolist()))
 
-    for _, row in unique_combinations.iterrows():
-        thickness = row['thickness_mm']
-        material = row['material']
-        material_key = thickness if material == 'S' else f"{thickness}_{material}"
-        logger.info(
-            f"\nОбработка: толщина={thickness}, материал={material}, ключ={material_key}")
 
-        # Выбираем детали для текущей комбинации материал/толщина
-        detail_mask = (details_df['thickness_mm'] == thickness) & (
-            details_df['material'] == material)
-        material_details = details_df[detail_mask].copy()
-        if material_details.empty:
-            logger.info("Нет деталей для этой комбинации")
-            continue
+def _rects_fitting_bin(rects, bin_length, bin_width):
+    """
+    Отбирает детали, которые помещаются в пустой контейнер хотя бы в одной ориентации.
 
-        # Выбираем листы материала для текущей комбинации
-        material_mask = (current_materials_df['thickness_mm'] == thickness) & (
-            current_materials_df['material'] == material)
-        material_sheets = current_materials_df[material_mask].copy()
-        if material_sheets.empty:
-            logger.info("Нет листов материала для этой комбинации")
-            continue
+    Остальные детали rectpack все равно отклонит, но только после попыток
+    разместить их в каждом свободном прямоугольнике контейнера.
 
-        # Подготовка деталей для упаковки
-        rects_to_pack = []
-        material_details = material_details.reset_index(drop=True)
-        for idx, detail in material_details.iterrows():
-            packing_width = detail['length_mm'] + kerf
-            packing_height = detail['width_mm'] + kerf
-            if packing_width <= 0 or packing_height <= 0:
-                logger.info(
-                    f"Пропуск детали {detail['part_id']}: некорректные размеры {packing_width}x{packing_height}")
-                continue
-            quantity = max(1, int(detail.get('quantity', 1)))
-            for _ in range(quantity):
-                rects_to_pack.append((packing_width, packing_height, idx))
+    Args:
+        rects: список деталей [(ширина, высота, индекс), ...]
+        bin_length: длина контейнера
+        bin_width: ширина контейнера
 
-        if not rects_to_pack:
-            logger.info("Нет деталей для упаковки")
-            continue
+    Returns:
+        list: детали, которые имеет смысл передавать упаковщику
+    """
+    return [rect for rect in rects
+            if (rect[0] <= bin_length and rect[1] <= bin_width) or
+            (rect[1] <= bin_length and rect[0] <= bin_width)]
 
-        logger.info(f"Подготовлено {len(rects_to_pack)} деталей для упаковки")
 
-        # Подготовка остатков
-        remnants = []
-        remnant_sheets = material_sheets[material_sheets['is_remnant'] == True].copy(
-        )
-        logger.info(f"Найдено {len(remnant_sheets)} типов остатков")
+def pack_material_group(thickness, material, material_details, material_sheets,
+                        margin=DEFAULT_MARGIN, kerf=DEFAULT_KERF, output_dir=".", write_dxf=True):
+    """
+    Упаковывает детали одной комбинации толщина/материал и создает DXF файлы.
 
-        # Создаем словарь для просмотра остатков по их ID
-        remnant_by_id = {}
+    Функция работает только со своими аргументами и не изменяет общих данных,
+    поэтому разные комбинации можно обрабатывать в отдельных процессах.
 
-        # Добавляем остатки в список
-        for _, row in remnant_sheets.iterrows():
-            # Получаем remnant_id - ключевое значение
-            remnant_id = row.get('remnant_id', None)
-            if remnant_id is None:
-                logger.warning(f"Пропуск остатка без ID: {row}")
-                continue
+    Args:
+        thickness: толщина материала
+        material: тип материала
+        material_details: DataFrame с деталями этой комбинации
+        material_sheets: DataFrame с листами и остатками этой комбинации
+        margin: отступ от края листа (мм)
+        kerf: диаметр фрезы (мм)
+        output_dir: директория для DXF файлов
+        write_dxf: создавать DXF файлы (False - только упаковка и подсчет карт)
 
-            remnant_length = float(row['sheet_length_mm'])
-            remnant_width = float(row['sheet_width_mm'])
+    Returns:
+        tuple: (контейнеры финального упаковщика, использованные remnant_id,
+                количество использованных целых листов, количество карт раскроя)
+               или None, если упаковка не выполнялась
+    """
+    # Подготовка деталей для упаковки
+    material_details = material_details.reset_index(drop=True)
+    rects_to_pack = prepare_rectangles_for_packing(material_details, kerf)
+
+    if not rects_to_pack:
+        logger.info("Нет деталей для упаковки")
+        return None
+
+    logger.info(f"Подготовлено {len(rects_to_pack)} деталей для упаковки")
+
+    # Подготовка остатков
+    remnants = []
+    remnant_sheets = material_sheets[material_sheets['is_remnant'] == True].copy(
+    )
+    logger.info(f"Найдено {len(remnant_sheets)} типов остатков")
+
+    # Создаем словарь для просмотра остатков по их ID
+    remnant_by_id = {}
+
+    # Добавляем остатки в список
+    for _, row in remnant_sheets.iterrows():
+        # Получаем remnant_id - ключевое значение
+        remnant_id = row.get('remnant_id', None)
+        if remnant_id is None:
+            logger.warning(f"Пропуск остатка без ID: {row}")
+            continue
 
-            # Проверяем размеры
-            if remnant_length <= 0 or remnant_width <= 0:
-                logger.warning(
-                    f"Пропуск остатка с ID={remnant_id} с некорректными размерами: {remnant_length}x{remnant_width}")
-                continue
+        remnant_length = float(row['sheet_length_mm'])
+        remnant_width = float(row['sheet_width_mm'])
 
-            # Добавляем каждый экземпляр остатка
-            for _ in range(int(row['total_quantity'])):
-                remnant = {
-                    'width': remnant_width,
-                    'length': remnant_length,
-                    'remnant_id': remnant_id,
-                    'width_with_margin': remnant_width - 2 * margin,
-                    'length_with_margin': remnant_length - 2 * margin
-                }
-                remnants.append(remnant)
+        # Проверяем размеры
+        if remnant_length <= 0 or remnant_width <= 0:
+            logger.warning(
+                f"Пропуск остатка с ID={remnant_id} с некорректными размерами: {remnant_length}x{remnant_width}")
+            continue
 
-                # Сохраняем для быстрого доступа
-                remnant_by_id[remnant_id] = remnant
+        # Добавляем каждый экземпляр остатка
+        for _ in range(int(row['total_quantity'])):
+            remnant = {
+                'width': remnant_width,
+                'length': remnant_length,
+                'remnant_id': remnant_id,
+                'width_with_margin': remnant_width - 2 * margin,
+                'length_with_margin': remnant_length - 2 * margin
+            }
+            remnants.append(remnant)
 
-            logger.info(
-                f"Добавлен остаток с ID={remnant_id}, размеры={remnant_length}x{remnant_width}")
+            # Сохраняем для быстрого доступа
+            remnant_by_id[remnant_id] = remnant
 
-        logger.info(f"Подготовлено {len(remnants)} остатков")
+        logger.info(
+            f"Добавлен остаток с ID={remnant_id}, размеры={remnant_length}x{remnant_width}")
+
+    logger.info(f"Подготовлено {len(remnants)} остатков")
+
+    # Сортируем остатки по убыванию площади
+    if remnants:
+        remnants.sort(key=lambda x: x['width'] * x['length'], reverse=True)
+        logger.info("Остатки отсортированы по площади (убывание)")
+
+    # Подготовка целых листов
+    full_sheet_rows = material_sheets[material_sheets['is_remnant'] == False]
+    sheet_lengths = full_sheet_rows['sheet_length_mm'].to_numpy(dtype=np.float64)
+    sheet_widths = full_sheet_rows['sheet_width_mm'].to_numpy(dtype=np.float64)
+    sheet_counts = np.maximum(
+        full_sheet_rows['total_quantity'].to_numpy().astype(np.int64), 0)
+
+    # Проверяем размеры
+    valid = (sheet_lengths > 0) & (sheet_widths > 0)
+    for sheet_length, sheet_width in zip(sheet_lengths[~valid].tolist(),
+                                         sheet_widths[~valid].tolist()):
+        logger.warning(
+            f"Пропуск листа с некорректными размерами: {sheet_length}x{sheet_width}")
+
+    # Добавляем каждый экземпляр листа: размеры разворачиваются по количеству
+    sheet_counts = sheet_counts[valid]
+    full_sheets = [
+        {
+            'width': sheet_width,
+            'length': sheet_length,
+            'width_with_margin': sheet_width - 2 * margin,
+            'length_with_margin': sheet_length - 2 * margin
+        }
+        for sheet_length, sheet_width in zip(
+            np.repeat(sheet_lengths[valid], sheet_counts).tolist(),
+            np.repeat(sheet_widths[valid], sheet_counts).tolist())
+    ]
+
+    logger.info(f"Подготовлено {len(full_sheets)} целых листов")
+
+    if not remnants and not full_sheets:
+        logger.info("Нет контейнеров для упаковки")
+        return None
+
+    # Сортируем детали для более эффективной упаковки
+    rects_to_pack = hybrid_sort(rects_to_pack)
+
+    # Подготовка упаковщиков
+    # Список упаковщиков (container_type, container_id, packer)
+    all_packers = []
+    used_remnant_ids = set()  # Набор использованных remnant_id
+    used_full_sheets = 0  # Счетчик использованных целых листов
+
+    # ФАЗА 1: Упаковка в остатки
+    logger.info("\nФаза 1: Упаковка в остатки")
+
+    # Неупакованные детали, обновляются после каждого использованного остатка
+    remaining_rects = rects_to_pack
+
+    for remnant in remnants:
+        # Все детали размещены - остальные остатки не понадобятся
+        if not remaining_rects:
+            break
+
+        remnant_id = remnant['remnant_id']
+
+        # Важно: используем размеры с учетом отступов
+        width_with_margin = remnant['width_with_margin']
+        length_with_margin = remnant['length_with_margin']
+
+        # Если ни одна деталь не помещается в остаток, упаковщик не создаем
+        fitting_rects = _rects_fitting_bin(
+            remaining_rects, length_with_margin, width_with_margin)
+        if not fitting_rects:
+            logger.info(
+                f"Остаток с ID={remnant_id} не использован - ни одна деталь не помещается")
+            continue
 
-        # Сортируем остатки по убыванию площади
-        if remnants:
-            remnants.sort(key=lambda x: x['width'] * x['length'], reverse=True)
-            logger.info("Остатки отсортированы по площади (убывание)")
+        # Создаем отдельный упаковщик для каждого остатка
+        logger.info(f"Создание упаковщика для остатка с ID={remnant_id}")
+        packer = newPacker(rotation=True, pack_algo=MaxRectsBaf)
 
-        # Подготовка целых листов
-        full_sheets = []
-        full_sheet_rows = material_sheets[material_sheets['is_remnant'] == False]
+        # Добавляем контейнер с размерами за вычетом отступов
+        packer.add_bin(length_with_margin, width_with_margin)
 
-        for _, row in full_sheet_rows.iterrows():
-            sheet_length = float(row['sheet_length_mm'])
-            sheet_width = float(row['sheet_width_mm'])
+        # Добавляем неупакованные детали, которые помещаются в остаток
+        for w, h, idx in fitting_rects:
+            packer.add_rect(w, h, idx)
 
-            # Проверяем размеры
-            if sheet_length <= 0 or sheet_width <= 0:
-                logger.warning(
-                    f"Пропуск листа с некорректными размерами: {sheet_length}x{sheet_width}")
-                continue
+        # Выполняем упаковку
+        packer.pack()
 
-            # Добавляем каждый экземпляр листа
-            for _ in range(int(row['total_quantity'])):
-                full_sheets.append({
-                    'width': sheet_width,
-                    'length': sheet_length,
-                    'width_with_margin': sheet_width - 2 * margin,
-                    'length_with_margin': sheet_length - 2 * margin
-                })
+        # Проверяем, есть ли что-то в упаковщике
+        # Пустой контейнер или нет контейнеров
+        if len(packer) == 0 or not packer[0]:
+            logger.info(
+                f"Остаток с ID={remnant_id} не использован - не удалось упаковать детали")
+            continue
 
-        logger.info(f"Подготовлено {len(full_sheets)} целых листов")
+        # Если упаковка успешна, сохраняем результат
+        logger.info(f"Остаток с ID={remnant_id} успешно использован")
+        all_packers.append(("remnant", remnant_id, packer))
+        used_remnant_ids.add(remnant_id)
 
-        if not remnants and not full_sheets:
-            logger.info("Нет контейнеров для упаковки")
-            continue
+        # Исключаем размещенные детали из дальнейшей упаковки
+        newly_packed = set(rect.rid for rect in packer[0])
+        remaining_rects = [
+            (w, h, idx) for w, h, idx in remaining_rects if idx not in newly_packed]
 
-        # Сортируем детали для более эффективной упаковки
-        rects_to_pack = hybrid_sort(rects_to_pack)
+    logger.info(f"Использовано остатков: {len(used_remnant_ids)}")
 
-        # Подготовка упаковщиков
-        # Список упаковщиков (container_type, container_id, packer)
-        all_packers = []
-        used_remnant_ids = set()  # Набор использованных remnant_id
-        used_full_sheets = 0  # Счетчик использованных целых листов
+    # ФАЗА 2: Упаковка оставшихся деталей в целые листы
+    logger.info("\nФаза 2: Упаковка в целые листы")
 
-        # ФАЗА 1: Упаковка в остатки
-        logger.info("\nФаза 1: Упаковка в остатки")
+    # remaining_rects - детали, которые не разместились в остатках
 
-        for remnant in remnants:
-            remnant_id = remnant['remnant_id']
+    if remaining_rects and full_sheets:
+        logger.info(
+            f"Осталось упаковать {len(remaining_rects)} деталей в целые листы")
 
-            # Создаем отдельный упаковщик для каждого остатка
-            logger.info(f"Создание упаковщика для остатка с ID={remnant_id}")
-            packer = newPacker(rotation=True, pack_algo=MaxRectsBaf)
+        # Упаковываем оставшиеся детали в целые листы
+        for i, sheet in enumerate(full_sheets):
+            if not remaining_rects:
+                break
 
-            # Важно: используем размеры с учетом отступов
-            width_with_margin = remnant['width_with_margin']
-            length_with_margin = remnant['length_with_margin']
+            # Создаем упаковщик для текущего листа
+            packer = newPacker(rotation=True, pack_algo=MaxRectsBssf)
 
             # Добавляем контейнер с размерами за вычетом отступов
-            packer.add_bin(length_with_margin, width_with_margin)
-
-            # Находим неупакованные детали
-            remaining_rects = []
-            packed_ids = set()
-            for p_type, p_id, p in all_packers:
-                if len(p) > 0 and p[0]:  # Проверяем наличие контейнера и деталей
-                    for rect in p[0]:
-                        packed_ids.add(rect.rid)
-
-            for w, h, idx in rects_to_pack:
-                if idx not in packed_ids:
-                    remaining_rects.append((w, h, idx))
-
-            # Добавляем все неупакованные детали
-            for w, h, idx in remaining_rects:
+            packer.add_bin(sheet['length_with_margin'],
+                           sheet['width_with_margin'])
+
+            # Добавляем оставшиеся детали, которые помещаются в лист
+            for w, h, idx in _rects_fitting_bin(remaining_rects, sheet['length_with_margin'],
+                                                sheet['width_with_margin']):
                 packer.add_rect(w, h, idx)
 
             # Выполняем упаковку
@@ -286,155 +358,118 @@ def pack_and_generate_dxf(details_df, materials_df, pattern_dir="patterns", marg
             # Проверяем, есть ли что-то в упаковщике
             # Пустой контейнер или нет контейнеров
             if len(packer) == 0 or not packer[0]:
-                logger.info(
-                    f"Остаток с ID={remnant_id} не использован - не удалось упаковать детали")
                 continue
 
             # Если упаковка успешна, сохраняем результат
-            logger.info(f"Остаток с ID={remnant_id} успешно использован")
-            all_packers.append(("remnant", remnant_id, packer))
-            used_remnant_ids.add(remnant_id)
-
-        logger.info(f"Использовано остатков: {len(used_remnant_ids)}")
-
-        # ФАЗА 2: Упаковка оставшихся деталей в целые листы
-        logger.info("\nФаза 2: Упаковка в целые листы")
+            sheet_id = i  # Просто индекс листа
+            all_packers.append(("sheet", sheet_id, packer))
+            used_full_sheets += 1
 
-        # Находим все детали, которые уже упакованы
-        packed_rects = set()
-        for p_type, p_id, packer in all_packers:
-            # Проверяем наличие контейнера и деталей
-            if len(packer) > 0 and packer[0]:
-                packed_rects.update(rect.rid for rect in packer[0])
+            # Обновляем список упакованных деталей
+            newly_packed = set(rect.rid for rect in packer[0])
 
-        # Определяем неупакованные детали
-        remaining_rects = [(w, h, idx)
-                           for w, h, idx in rects_to_pack if idx not in packed_rects]
+            # Обновляем список оставшихся деталей
+            remaining_rects = [
+                (w, h, idx) for w, h, idx in remaining_rects if idx not in newly_packed]
 
-        if remaining_rects and full_sheets:
-            logger.info(
-                f"Осталось упаковать {len(remaining_rects)} деталей в целые листы")
-
-            # Упаковываем оставшиеся детали в целые листы
-            for i, sheet in enumerate(full_sheets):
-                if not remaining_rects:
-                    break
-
-                # Создаем упаковщик для текущего листа
-                packer = newPacker(rotation=True, pack_algo=MaxRectsBssf)
+            logger.info(f"Лист {i}: упаковано {len(newly_packed)} деталей")
 
-                # Добавляем контейнер с размерами за вычетом отступов
-                packer.add_bin(sheet['length_with_margin'],
-                               sheet['width_with_margin'])
+    logger.info(f"Использовано целых листов: {used_full_sheets}")
 
-                # Добавляем все оставшиеся детали
-                for w, h, idx in remaining_rects:
-                    packer.add_rect(w, h, idx)
+    # ФАЗА 3: Создание DXF файлов и финального упаковщика
+    logger.info("\nФаза 3: Создание DXF файлов")
 
-                # Выполняем упаковку
-                packer.pack()
+    # Контейнеры финального упаковщика: [(длина, ширина, [(w, h, rid), ...]), ...]
+    final_bins = []
 
-                # Проверяем, есть ли что-то в упаковщике
-                # Пустой контейнер или нет контейнеров
-                if len(packer) == 0 or not packer[0]:
-                    continue
+    # Файлы сохраняются в фоновых потоках; карта учитывается после записи файла
+    saver = ThreadPoolExecutor(max_workers=DXF_SAVE_WORKERS) if write_dxf else None
+    pending_saves = []  # (future, container_id, output_file, контейнер)
 
-                # Если упаковка успешна, сохраняем результат
-                sheet_id = i  # Просто индекс листа
-                all_packers.append(("sheet", sheet_id, packer))
-                used_full_sheets += 1
+    # Части имен файлов, общие для всех карт комбинации
+    thickness_str = f"{int(thickness)}" if float(
+        thickness).is_integer() else f"{thickness}"
+    material_suffix = f"_{material}" if material != 'S' else ""
 
-                # Обновляем список упакованных деталей
-                newly_packed = set(rect.rid for rect in packer[0])
-                packed_rects.update(newly_packed)
-
-                # Обновляем список оставшихся деталей
-                remaining_rects = [
-                    (w, h, idx) for w, h, idx in remaining_rects if idx not in newly_packed]
-
-                logger.info(f"Лист {i}: упаковано {len(newly_packed)} деталей")
+    # Данные деталей по индексу: словари и списки размеров вместо обращений
+    # к DataFrame через iloc для каждой размещенной детали
+    if write_dxf:
+        details_records = material_details.to_dict('records')
+        orig_lengths = material_details['length_mm'].to_numpy(dtype=np.float64)
+        orig_widths = material_details['width_mm'].to_numpy(dtype=np.float64)
+    layout_count = 0  # Подсчёт созданных карт раскроя
 
-        logger.info(f"Использовано целых листов: {used_full_sheets}")
+    # Обрабатываем каждый упаковщик
+    for container_type, container_id, packer in all_packers:
+        # Пропускаем пустые контейнеры
+        if len(packer) == 0 or not packer[0]:
+            continue
 
-        # ФАЗА 3: Создание DXF файлов и финального упаковщика
-        logger.info("\nФаза 3: Создание DXF файлов")
+        # Определяем тип контейнера
+        is_remnant = (container_type == "remnant")
 
-        # Создаем финальный упаковщик
-        final_packer = newPacker(rotation=True, pack_algo=MaxRectsBssf)
-        bin_counter = 0
+        # Получаем информацию о размерах
+        if is_remnant:
+            # Для остатка
+            remnant_id = container_id
+            remnant = remnant_by_id.get(remnant_id)
+            if not remnant:
+                logger.error(
+                    f"Не найдена информация об остатке с ID={remnant_id}")
+                continue
 
-        # Обрабатываем каждый упаковщик
-        for container_type, container_id, packer in all_packers:
-            # Пропускаем пустые контейнеры
-            if len(packer) == 0 or not packer[0]:
+            original_width = remnant['width']
+            original_length = remnant['length']
+            width_with_margin = remnant['width_with_margin']
+            length_with_margin = remnant['length_with_margin']
+        else:
+            # Для целого листа
+            sheet_idx = container_id
+            if sheet_idx >= len(full_sheets):
+                logger.error(
+                    f"Индекс листа {sheet_idx} выходит за пределы списка листов")
                 continue
 
-            # Определяем тип контейнера
-            is_remnant = (container_type == "remnant")
-
-            # Получаем информацию о размерах
-            if is_remnant:
-                # Для остатка
-                remnant_id = container_id
-                remnant = remnant_by_id.get(remnant_id)
-                if not remnant:
-                    logger.error(
-                        f"Не найдена информация об остатке с ID={remnant_id}")
-                    continue
-
-                original_width = remnant['width']
-                original_length = remnant['length']
-                width_with_margin = remnant['width_with_margin']
-                length_with_margin = remnant['length_with_margin']
-            else:
-                # Для целого листа
-                sheet_idx = container_id
-                if sheet_idx >= len(full_sheets):
-                    logger.error(
-                        f"Индекс листа {sheet_idx} выходит за пределы списка листов")
-                    continue
-
-                sheet = full_sheets[sheet_idx]
-                original_width = sheet['width']
-                original_length = sheet['length']
-                width_with_margin = sheet['width_with_margin']
-                length_with_margin = sheet['length_with_margin']
-
-            # Создаем DXF документ
-            try:
+            sheet = full_sheets[sheet_idx]
+            original_width = sheet['width']
+            original_length = sheet['length']
+            width_with_margin = sheet['width_with_margin']
+            length_with_margin = sheet['length_with_margin']
+
+        try:
+            # Создаем DXF документ (при расчете без файлов только считаем карты)
+            if write_dxf:
                 doc, msp = create_new_dxf()
                 add_sheet_outline(msp, original_length, original_width, margin)
-                details_list = []
-
-                # Добавляем все детали в DXF
-                for rect in packer[0]:
-                    idx = rect.rid
-                    detail = material_details.iloc[idx]
-
-                    # Рассчитываем фактические размеры детали (за вычетом kerf)
-                    rect_width = rect.width - kerf
-                    rect_height = rect.height - kerf
 
-                    # Определяем, была ли деталь повернута
-                    orig_width = detail['length_mm']
-                    orig_height = detail['width_mm']
-                    is_rotated = (abs(rect_width - orig_width) >
-                                  0.1) or (abs(rect_height - orig_height) > 0.1)
-
-                    # Создаем информацию о детали для DXF
-                    detail_rect = {
+                # Определяем повернутые детали сразу для всего контейнера:
+                # размеры за вычетом kerf не совпадают с исходными
+                bin_rects = list(packer[0])
+                rids = np.fromiter((rect.rid for rect in bin_rects),
+                                   dtype=np.int64, count=len(bin_rects))
+                placed_widths = np.fromiter((rect.width for rect in bin_rects),
+                                            dtype=np.float64, count=len(bin_rects)) - kerf
+                placed_heights = np.fromiter((rect.height for rect in bin_rects),
+                                             dtype=np.float64, count=len(bin_rects)) - kerf
+                rotated_mask = ((np.abs(placed_widths - orig_lengths[rids]) > 0.1) |
+                                (np.abs(placed_heights - orig_widths[rids]) > 0.1))
+
+                # Собираем расположение всех деталей контейнера
+                # (фактические размеры - за вычетом kerf)
+                placements = [
+                    (details_records[rect.rid], {
                         'x': rect.x + margin,
                         'y': rect.y + margin,
-                        'width': rect_width,
-                        'height': rect_height,
+                        'width': rect.width - kerf,
+                        'height': rect.height - kerf,
                         'rotated': is_rotated
-                    }
+                    })
+                    for rect, is_rotated in zip(bin_rects, rotated_mask.tolist())
+                ]
 
-                    # Добавляем деталь в DXF
-                    detail_info = add_detail_to_sheet(
-                        msp, detail, detail_rect, kerf)
-                    if detail_info:
-                        details_list.append(detail_info)
+                # Добавляем все детали в DXF за один проход,
+                # неудачные детали (None) в список деталей не попадают
+                details_list = [d for d in add_details_to_sheet(msp, placements, kerf) if d]
 
                 # Формируем имя файла
                 if is_remnant:
@@ -442,33 +477,18 @@ def pack_and_generate_dxf(details_df, materials_df, pattern_dir="patterns", marg
                     # Форматируем ID (убираем .0 в конце для целых значений)
                     formatted_id = format_remnant_id(remnant_id)
 
-                    # Преобразуем thickness в целое число, если оно целое
-                    thickness_int = int(thickness) if float(
-                        thickness).is_integer() else thickness
-
                     # Формируем имя файла с целыми значениями размеров
                     length_int = int(original_length)
                     width_int = int(original_width)
 
-                    if material != 'S':
-                        output_file = f"{formatted_id}_{length_int}x{width_int}_{thickness_int}mm_{material}.dxf"
-                    else:
-                        output_file = f"{formatted_id}_{length_int}x{width_int}_{thickness_int}mm.dxf"
+                    output_file = f"{formatted_id}_{length_int}x{width_int}_{thickness_str}mm{material_suffix}.dxf"
 
                     logger.info(
                         f"Создается карта раскроя для остатка с ID={remnant_id} → {formatted_id}, файл={output_file}")
                 else:
                     # Для целого листа используем счетчик
                     sheet_idx = container_id
-
-                    # Преобразуем thickness в целое число, если оно целое
-                    thickness_int = int(thickness) if float(
-                        thickness).is_integer() else thickness
-
-                    if material != 'S':
-                        output_file = f"sheet_{thickness_int}mm_{material}_{sheet_idx}.dxf"
-                    else:
-                        output_file = f"sheet_{thickness_int}mm_{sheet_idx}.dxf"
+                    output_file = f"sheet_{thickness_str}mm{material_suffix}_{sheet_idx}.dxf"
                     logger.info(
                         f"Создается карта раскроя для целого листа: {output_file}")
 
@@ -480,26 +500,237 @@ def pack_and_generate_dxf(details_df, materials_df, pattern_dir="patterns", marg
                 # Не передаем имя файла!
                 add_details_list(msp, original_width, details_list)
 
-                # Сохраняем файл
-                doc.saveas(output_file)
-                logger.info(f"Сохранен файл: {output_file}")
+            # Контейнер и его детали для финального упаковщика
+            final_bin = (length_with_margin, width_with_margin,
+                         [(rect.width, rect.height, rect.rid) for rect in packer[0]])
+
+            if write_dxf:
+                # Сохраняем файл, не дожидаясь окончания записи
+                future = saver.submit(
+                    doc.saveas, os.path.join(output_dir, output_file))
+                pending_saves.append(
+                    (future, container_id, output_file, final_bin))
+            else:
                 layout_count += 1
+                final_bins.append(final_bin)
+
+        except Exception as e:
+            logger.error(
+                f"Ошибка при создании DXF для контейнера {container_id}: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+
+    # Дожидаемся записи файлов в исходном порядке контейнеров
+    for future, container_id, output_file, final_bin in pending_saves:
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(
+                f"Ошибка при создании DXF для контейнера {container_id}: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            continue
+        logger.info(f"Сохранен файл: {output_file}")
+        layout_count += 1
+        final_bins.append(final_bin)
 
-                # Добавляем контейнер в финальный упаковщик
-                final_packer.add_bin(length_with_margin,
-                                     width_with_margin, bid=bin_counter)
+    if saver is not None:
+        saver.shutdown()
 
-                # Добавляем все детали в финальный упаковщик
-                for rect in packer[0]:
-                    final_packer.add_rect(rect.width, rect.height, rect.rid)
+    return final_bins, used_remnant_ids, used_full_sheets, layout_count
 
-                bin_counter += 1
 
-            except Exception as e:
-                logger.error(
-                    f"Ошибка при создании DXF для контейнера {container_id}: {str(e)}")
-                import traceback
-                logger.error(traceback.format_exc())
+def _build_final_packer(final_bins):
+    """
+    Создает финальный упаковщик комбинации по описанию контейнеров.
+
+    Args:
+        final_bins: список контейнеров [(длина, ширина, [(w, h, rid), ...]), ...]
+
+    Returns:
+        упаковщик rectpack с добавленными контейнерами и деталями
+    """
+    final_packer = newPacker(rotation=True, pack_algo=MaxRectsBssf)
+    for bin_counter, (bin_length, bin_width, rects) in enumerate(final_bins):
+        final_packer.add_bin(bin_length, bin_width, bid=bin_counter)
+        for w, h, rid in rects:
+            final_packer.add_rect(w, h, rid)
+    return final_packer
+
+
+class _LogCollector(logging.Handler):
+    """Собирает записи лога дочернего процесса для передачи в основной процесс"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Форматируем сообщение заранее, чтобы запись можно было передать между процессами
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+def _pack_material_group_logged(log_level, *args):
+    """
+    Выполняет pack_material_group в дочернем процессе.
+
+    Записи лога не выводятся в дочернем процессе, а возвращаются вместе
+    с результатом, чтобы основной процесс передал их своим обработчикам.
+    """
+    collector = _LogCollector()
+    logger.handlers = [collector]
+    logger.setLevel(log_level)
+    logger.propagate = False
+    return pack_material_group(*args), collector.records
+
+
+def _run_material_groups(jobs, margin, kerf, output_dir, max_workers=None, write_dxf=True):
+    """
+    Упаковывает комбинации толщина/материал, по возможности параллельно.
+
+    Args:
+        jobs: список (thickness, material, material_details, material_sheets)
+        margin: отступ от края листа (мм)
+        kerf: диаметр фрезы (мм)
+        output_dir: директория для DXF файлов
+        max_workers: количество процессов (None - по числу процессоров для больших
+            заказов, 1 - без процессов)
+        write_dxf: создавать DXF файлы
+
+    Returns:
+        list: результаты pack_material_group в порядке jobs
+    """
+    if max_workers is None:
+        # Небольшие заказы быстрее упаковать в текущем процессе
+        details_count = sum(len(job[2]) for job in jobs)
+        if details_count < PARALLEL_PACKING_MIN_DETAILS:
+            max_workers = 1
+        else:
+            max_workers = min(len(jobs), os.cpu_count() or 1)
+
+    if max_workers > 1 and len(jobs) > 1:
+        try:
+            # spawn одинаково работает на всех платформах и не копирует потоки GUI
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = [
+                    executor.submit(_pack_material_group_logged, logger.getEffectiveLevel(),
+                                    thickness, material, material_details, material_sheets,
+                                    margin, kerf, output_dir, write_dxf)
+                    for thickness, material, material_details, material_sheets in jobs
+                ]
+                results = []
+                for future in futures:
+                    result, records = future.result()
+                    for record in records:
+                        logger.handle(record)
+                    results.append(result)
+                return results
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning(
+                f"Не удалось выполнить упаковку в отдельных процессах, упаковка в текущем процессе: {str(e)}")
+
+    return [pack_material_group(thickness, material, material_details, material_sheets,
+                                margin, kerf, output_dir, write_dxf)
+            for thickness, material, material_details, material_sheets in jobs]
+
+
+def pack_and_generate_dxf(details_df, materials_df, pattern_dir="patterns", margin=DEFAULT_MARGIN, kerf=DEFAULT_KERF,
+                          output_dir=".", max_workers=None, write_dxf=True):
+    """
+    Упаковывает детали и генерирует DXF файлы с приоритетом остатков.
+    Гарантирует сохранение оригинальных remnant_id при создании карт раскроя.
+
+    Args:
+        details_df: DataFrame с деталями
+        materials_df: DataFrame с материалами
+        pattern_dir: директория с узорами
+        margin: отступ от края листа (мм)
+        kerf: диаметр фрезы (мм)
+        output_dir: директория для DXF файлов и обновленной таблицы материалов
+        max_workers: количество процессов для упаковки комбинаций материал/толщина
+            (None - по числу процессоров для больших заказов, 1 - в текущем процессе)
+        write_dxf: создавать DXF файлы (False - только расчет раскроя и таблицы материалов)
+
+    Returns:
+        tuple: (словарь упаковщиков, количество использованных листов, количество карт раскроя)
+    """
+    logger.info("Запуск упаковки с полным приоритетом остатков")
+
+    packers_by_material = {}
+    total_used_sheets = 0
+    remnants_manager = RemnantsManager(margin=margin, kerf=kerf)
+    current_materials_df = materials_df.copy()
+    layout_count = 0  # Подсчёт созданных карт раскроя
+    jobs = []  # Комбинации для упаковки: (thickness, material, details, sheets)
+    job_keys = []  # Ключи материалов в том же порядке
+
+    # Проверка наличия обязательных колонок
+    for col in MATERIALS_REQUIRED_COLUMNS:
+        if col not in current_materials_df.columns:
+            logger.error(f"Отсутствует колонка '{col}' в materials_df")
+            raise ValueError(f"Missing column '{col}' in materials_df")
+    for col in DETAILS_REQUIRED_COLUMNS:
+        if col not in details_df.columns:
+            logger.error(f"Отсутствует колонка '{col}' в details_df")
+            raise ValueError(f"Missing column '{col}' in details_df")
+
+    # Добавляем колонку remnant_id, если её нет в таблице материалов
+    if 'remnant_id' not in current_materials_df.columns:
+        current_materials_df['remnant_id'] = None
+        logger.info(
+            "Добавлена колонка 'remnant_id' со значением None для исходной таблицы материалов")
+
+    unique_combinations = details_df[[
+        'thickness_mm', 'material']].drop_duplicates()
+    logger.info(
+        f"Найдено {len(unique_combinations)} комбинаций материалов/толщин")
+
+    # Позиции строк каждой комбинации толщина/материал за один проход,
+    # вместо построения масок по всей таблице для каждой комбинации
+    detail_groups = details_df.groupby(
+        ['thickness_mm', 'material'], sort=False).indices
+    sheet_groups = current_materials_df.groupby(
+        ['thickness_mm', 'material'], sort=False).indices
+
+    # Порядок комбинаций - по первому появлению в таблице деталей
+    for thickness, material in unique_combinations.itertuples(index=False, name=None):
+        material_key = thickness if material == 'S' else f"{thickness}_{material}"
+        logger.info(
+            f"\nОбработка: толщина={thickness}, материал={material}, ключ={material_key}")
+
+        # Выбираем детали для текущей комбинации материал/толщина
+        detail_positions = detail_groups.get((thickness, material))
+        if detail_positions is None:
+            logger.info("Нет деталей для этой комбинации")
+            continue
+        material_details = details_df.iloc[detail_positions].copy()
+
+        # Выбираем листы материала для текущей комбинации
+        sheet_positions = sheet_groups.get((thickness, material))
+        if sheet_positions is None:
+            logger.info("Нет листов материала для этой комбинации")
+            continue
+        material_sheets = current_materials_df.iloc[sheet_positions].copy()
+
+        jobs.append((thickness, material, material_details, material_sheets))
+        job_keys.append(material_key)
+
+    # Упаковываем комбинации независимо друг от друга (по возможности параллельно),
+    # а таблицу материалов обновляем последовательно в исходном порядке
+    results = _run_material_groups(
+        jobs, margin, kerf, output_dir, max_workers, write_dxf)
+
+    for (thickness, material, _, _), material_key, result in zip(jobs, job_keys, results):
+        if result is None:
+            continue
+
+        final_bins, used_remnant_ids, used_full_sheets, group_layout_count = result
+        layout_count += group_layout_count
+        final_packer = _build_final_packer(final_bins)
 
         # Устанавливаем финальный упаковщик для этой комбинации материал/толщина
         packers_by_material[material_key] = final_packer
@@ -559,13 +790,13 @@ def pack_and_generate_dxf(details_df, materials_df, pattern_dir="patterns", marg
             "Перед сохранением добавлена отсутствующая колонка 'remnant_id'")
 
     # Выводим итоговую статистику
-    remnants_count = sum(
-        1 for _, row in current_materials_df.iterrows() if row.get('is_remnant', False))
+    remnants_count = int(current_materials_df['is_remnant'].astype(bool).sum()) \
+        if 'is_remnant' in current_materials_df.columns else 0
     logger.info(f"Итоговое количество остатков в таблице: {remnants_count}")
 
     # Сохраняем обновленную таблицу материалов
     remnants_manager.save_material_table(
-        current_materials_df, "updated_materials.csv")
+        current_materials_df, os.path.join(output_dir, "updated_materials.csv"))
 
     logger.info(
         f"Упаковка завершена. Всего листов: {total_used_sheets}, карт раскроя: {layout_count}")
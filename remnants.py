@@ -15,6 +15,17 @@ class RemnantsManager:
         self.min_remnant_length = 1000
         # Удаляем словарь для учета созданных идентификаторов
 
+    def set_params(self, margin, kerf):
+        """
+        Задает параметры раскроя для следующего расчета остатков.
+
+        Args:
+            margin: отступ от края листа (мм)
+            kerf: диаметр фрезы (мм)
+        """
+        self.margin = margin
+        self.kerf = kerf
+
     def format_remnant_id(self, remnant_id):
         """
         Оставляет ID остатка без изменений.
@@ -130,72 +141,72 @@ class RemnantsManager:
         Returns:
             DataFrame: обновленная таблица материалов
         """
-        logger.info(
-            f"Обновление таблицы для толщина={thickness}, материал={material}")
-        updated_materials = materials_df.copy()
+        update = self.calculate_material_update(
+            materials_df, packer, thickness, material, used_sheets,
+            sheet_length, sheet_width)
+        return self.apply_material_updates(
+            materials_df, [update] if update is not None else [])
 
-        # Добавляем колонку is_remnant, если её нет
-        if 'is_remnant' not in updated_materials.columns:
-            updated_materials['is_remnant'] = False
-            logger.info(
-                "Добавлена колонка 'is_remnant' со значением False для исходных данных")
+    def calculate_material_update(self, materials_df, packer, thickness, material, used_sheets, sheet_length=None, sheet_width=None):
+        """
+        Рассчитывает изменения таблицы материалов для одной комбинации,
+        не изменяя саму таблицу.
 
-        # Добавляем колонку remnant_id, если её нет
-        if 'remnant_id' not in updated_materials.columns:
-            # Только для остатков будут идентификаторы, для целых листов - None
-            updated_materials['remnant_id'] = None
-            logger.info(
-                "Добавлена колонка 'remnant_id' со значением None для исходных данных")
+        Args:
+            materials_df: DataFrame с материалами
+            packer: упаковщик с размещенными деталями
+            thickness: толщина материала
+            material: тип материала
+            used_sheets: количество использованных листов
+            sheet_length: длина листа (если None, берётся из materials_df)
+            sheet_width: ширина листа (если None, берётся из materials_df)
 
-        # НЕ преобразуем remnant_id для сохранения исходных значений
-        # Просто выведем для диагностики несколько значений
-        mask = ~updated_materials['remnant_id'].isna()
-        if mask.any():
-            logger.info(f"Примеры текущих значений remnant_id:")
-            for idx, val in updated_materials.loc[mask, 'remnant_id'].head(5).items():
-                logger.info(
-                    f"  Индекс {idx}: {val} (тип: {type(val).__name__})")
+        Returns:
+            dict: {'thickness_mm', 'material', 'quantities': {индекс: новое количество},
+                   'new_remnants': [строки новых остатков]} или None,
+                   если размеры листа определить не удалось
+        """
+        logger.info(
+            f"Обновление таблицы для толщина={thickness}, материал={material}")
+
+        # Целые листы этой комбинации (без колонки is_remnant все строки - листы)
+        material_mask = (materials_df['thickness_mm'] == thickness) & \
+            (materials_df['material'] == material)
+        if 'is_remnant' in materials_df.columns:
+            material_mask &= materials_df['is_remnant'] == False
+        material_rows = materials_df[material_mask]
 
         # Определяем стандартные размеры целого листа
         if sheet_length is None or sheet_width is None:
-            material_mask = (updated_materials['thickness_mm'] == thickness) & \
-                (updated_materials['material'] == material) & \
-                (updated_materials['is_remnant'] == False)
-            thickness_rows = updated_materials[material_mask]
-            if thickness_rows.empty:
+            if material_rows.empty:
                 logger.warning(
                     f"Не найдены целые листы для толщина={thickness}, материал={material}")
-                return updated_materials
+                return None
             try:
-                sheet_length = float(thickness_rows['sheet_length_mm'].iloc[0])
-                sheet_width = float(thickness_rows['sheet_width_mm'].iloc[0])
+                sheet_length = float(material_rows['sheet_length_mm'].iloc[0])
+                sheet_width = float(material_rows['sheet_width_mm'].iloc[0])
                 if sheet_length <= 0 or sheet_width <= 0:
                     logger.warning(
                         f"Некорректные размеры листа: {sheet_length}x{sheet_width}")
-                    return updated_materials
+                    return None
             except (ValueError, TypeError):
                 logger.error("Ошибка получения размеров листа из таблицы")
-                return updated_materials
+                return None
 
         # Уменьшаем количество целых листов
+        quantities = {}
         if used_sheets > 0:
-            material_mask = (updated_materials['thickness_mm'] == thickness) & \
-                (updated_materials['material'] == material) & \
-                (updated_materials['is_remnant'] == False)
-            material_rows = updated_materials[material_mask]
             if material_rows.empty:
                 logger.warning(
                     f"Не найдены целые листы для уменьшения количества")
             else:
                 remaining_sheets = used_sheets
-                for idx in material_rows.index:
-                    original_qty = updated_materials.loc[idx, 'total_quantity']
+                for idx, original_qty in material_rows['total_quantity'].items():
                     sheets_to_deduct = min(remaining_sheets, original_qty)
-                    updated_materials.loc[idx, 'total_quantity'] = max(
-                        0, original_qty - sheets_to_deduct)
+                    quantities[idx] = max(0, original_qty - sheets_to_deduct)
                     remaining_sheets -= sheets_to_deduct
                     logger.info(
-                        f"Лист {idx}: количество уменьшено с {original_qty} до {updated_materials.loc[idx, 'total_quantity']}")
+                        f"Лист {idx}: количество уменьшено с {original_qty} до {quantities[idx]}")
                     if remaining_sheets <= 0:
                         break
                 if remaining_sheets > 0:
@@ -208,61 +219,106 @@ class RemnantsManager:
         logger.info(f"Найдено {len(remnants)} остатков")
 
         # НЕ удаляем старые остатки автоматически - они должны сохраняться
-        # Создаем таблицу новых остатков
-        if remnants:
-            # Собираем новые остатки в список словарей
-            remnant_rows = []
-            for remnant_length, remnant_width in remnants:
-                # Новые остатки будут с NULL в поле remnant_id
-                # Пользователь сам определит их ID по факту использования
-                remnant_row = {
-                    'thickness_mm': thickness,
-                    'material': material,
-                    'sheet_length_mm': float(remnant_length),
-                    'sheet_width_mm': float(remnant_width),
-                    'total_quantity': 1,
-                    'is_remnant': True,
-                    'remnant_id': None  # NULL для новых остатков
-                }
-                remnant_rows.append(remnant_row)
-                logger.info(
-                    f"Добавлен новый остаток: {remnant_length}x{remnant_width}, ID: None (требуется заполнение)")
-
-            # Создаем DataFrame из новых остатков
-            if remnant_rows:
-                # Используем явный список колонок, чтобы гарантировать наличие remnant_id
-                columns = ['thickness_mm', 'material', 'sheet_length_mm',
-                           'sheet_width_mm', 'total_quantity', 'is_remnant', 'remnant_id']
-
-                remnants_df = pd.DataFrame(remnant_rows, columns=columns)
-
-                # Обеспечиваем корректный тип данных
-                numeric_cols = ['sheet_length_mm',
-                                'sheet_width_mm', 'total_quantity']
-                for col in numeric_cols:
-                    remnants_df[col] = pd.to_numeric(
-                        remnants_df[col], errors='coerce').fillna(0)
-
-                # Добавляем только новые остатки в обновленную таблицу
-                # Существующие остатки уже присутствуют в updated_materials
-                updated_materials = pd.concat(
-                    [updated_materials, remnants_df], ignore_index=True)
-                logger.info(
-                    f"Добавлено {len(remnants_df)} новых остатков в таблицу")
+        # Собираем новые остатки в список словарей
+        remnant_rows = []
+        for remnant_length, remnant_width in remnants:
+            # Новые остатки будут с NULL в поле remnant_id
+            # Пользователь сам определит их ID по факту использования
+            remnant_rows.append({
+                'thickness_mm': thickness,
+                'material': material,
+                'sheet_length_mm': float(remnant_length),
+                'sheet_width_mm': float(remnant_width),
+                'total_quantity': 1,
+                'is_remnant': True,
+                'remnant_id': None  # NULL для новых остатков
+            })
+            logger.info(
+                f"Добавлен новый остаток: {remnant_length}x{remnant_width}, ID: None (требуется заполнение)")
+
+        return {
+            'thickness_mm': thickness,
+            'material': material,
+            'quantities': quantities,
+            'new_remnants': remnant_rows
+        }
+
+    def apply_material_updates(self, materials_df, updates):
+        """
+        Применяет изменения, рассчитанные calculate_material_update, к таблице
+        материалов: одна копия таблицы и одно объединение с новыми остатками
+        на все комбинации.
+
+        Args:
+            materials_df: DataFrame с материалами
+            updates: список изменений по комбинациям толщина/материал
+
+        Returns:
+            DataFrame: обновленная таблица материалов
+        """
+        updated_materials = materials_df.copy()
+
+        # Добавляем колонку is_remnant, если её нет
+        if 'is_remnant' not in updated_materials.columns:
+            updated_materials['is_remnant'] = False
+            logger.info(
+                "Добавлена колонка 'is_remnant' со значением False для исходных данных")
+
+        # Добавляем колонку remnant_id, если её нет
+        if 'remnant_id' not in updated_materials.columns:
+            # Только для остатков будут идентификаторы, для целых листов - None
+            updated_materials['remnant_id'] = None
+            logger.info(
+                "Добавлена колонка 'remnant_id' со значением None для исходных данных")
 
-                # Логируем для отладки
+        # НЕ преобразуем remnant_id для сохранения исходных значений
+        # Просто выведем для диагностики несколько значений
+        mask = ~updated_materials['remnant_id'].isna()
+        if mask.any():
+            logger.info(f"Примеры текущих значений remnant_id:")
+            for idx, val in updated_materials.loc[mask, 'remnant_id'].head(5).items():
                 logger.info(
-                    f"Колонки в обновленной таблице: {', '.join(updated_materials.columns)}")
-                if 'remnant_id' in updated_materials.columns:
-                    logger.info(
-                        "Колонка remnant_id присутствует в итоговой таблице")
-                else:
-                    logger.error(
-                        "Колонка remnant_id ОТСУТСТВУЕТ в итоговой таблице!")
-            else:
-                logger.info("Новых остатков не добавлено")
-        else:
+                    f"  Индекс {idx}: {val} (тип: {type(val).__name__})")
+
+        remnant_rows = []
+        for update in updates:
+            for idx, quantity in update['quantities'].items():
+                updated_materials.loc[idx, 'total_quantity'] = quantity
+            remnant_rows.extend(update['new_remnants'])
+
+        if not remnant_rows:
             logger.info("Новых остатков не обнаружено")
+            return updated_materials
+
+        # Используем явный список колонок, чтобы гарантировать наличие remnant_id
+        columns = ['thickness_mm', 'material', 'sheet_length_mm',
+                   'sheet_width_mm', 'total_quantity', 'is_remnant', 'remnant_id']
+
+        remnants_df = pd.DataFrame(remnant_rows, columns=columns)
+
+        # Обеспечиваем корректный тип данных
+        numeric_cols = ['sheet_length_mm',
+                        'sheet_width_mm', 'total_quantity']
+        for col in numeric_cols:
+            remnants_df[col] = pd.to_numeric(
+                remnants_df[col], errors='coerce').fillna(0)
+
+        # Добавляем только новые остатки в обновленную таблицу
+        # Существующие остатки уже присутствуют в updated_materials
+        updated_materials = pd.concat(
+            [updated_materials, remnants_df], ignore_index=True)
+        logger.info(
+            f"Добавлено {len(remnants_df)} новых остатков в таблицу")
+
+        # Логируем для отладки
+        logger.info(
+            f"Колонки в обновленной таблице: {', '.join(updated_materials.columns)}")
+        if 'remnant_id' in updated_materials.columns:
+            logger.info(
+                "Колонка remnant_id присутствует в итоговой таблице")
+        else:
+            logger.error(
+                "Колонка remnant_id ОТСУТСТВУЕТ в итоговой таблице!")
 
         return updated_materials
 
@@ -1,7 +1,21 @@
 import logging
+import os
+import numpy as np
 import pandas as pd
 import re
 from .config import logger
+from .constants import DETAILS_CSV_DTYPES, MATERIALS_CSV_DTYPES
+
+# Кэш прочитанных CSV-файлов между запусками раскроя:
+# ключ - пути к файлам и кодировки, значение - (отметки файлов, details_df, materials_df)
+_csv_cache = {}
+
+# Числовые колонки, проверяемые на пустые и отрицательные значения
+# (первые три - размеры и количество, не могут быть отрицательными)
+_CRITICAL_NUMERIC_DETAILS = ['length_mm', 'width_mm', 'quantity', 'thickness_mm']
+_CRITICAL_NUMERIC_MATERIALS = [
+    'sheet_length_mm', 'sheet_width_mm', 'total_quantity', 'thickness_mm'
+]
 
 
 def set_log_level(level_name):
@@ -20,9 +34,17 @@ def set_log_level(level_name):
     logger.info(f"Уровень логирования изменен на: {level_name}")
 
 
+def _file_stamp(path):
+    """Возвращает отметку файла (время изменения, размер) для проверки кэша"""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
 def read_csv_files(details_path, materials_path, encodings):
     """
-    Читает CSV файлы с данными деталей и материалов
+    Читает CSV файлы с данными деталей и материалов.
+    Если файлы не изменились с прошлого чтения, возвращает копии
+    ранее разобранных таблиц без повторного разбора CSV.
 
     Args:
         details_path: путь к файлу с деталями
@@ -35,14 +57,27 @@ def read_csv_files(details_path, materials_path, encodings):
     details_df = None
     materials_df = None
 
+    # Проверяем, не читались ли уже эти файлы в неизменном виде
+    cache_key = (os.path.abspath(details_path),
+                 os.path.abspath(materials_path), tuple(encodings))
+    try:
+        stamps = (_file_stamp(details_path), _file_stamp(materials_path))
+    except OSError:
+        stamps = None
+
+    cached = _csv_cache.get(cache_key)
+    if stamps is not None and cached is not None and cached[0] == stamps:
+        logger.info("Файлы не изменились, используются ранее прочитанные данные")
+        return cached[1].copy(), cached[2].copy()
+
     # Пытаемся прочитать файлы с различными кодировками
     for encoding in encodings:
         try:
             # Чтение с параметром low_memory=False для полной загрузки данных
             details_df = pd.read_csv(details_path, sep=';', encoding=encoding, low_memory=False,
-                                     dtype={'order_id': str, 'bevel_type': str, 'thickness_mm': float, 'material': str})
+                                     dtype=DETAILS_CSV_DTYPES)
             materials_df = pd.read_csv(materials_path, sep=';', encoding=encoding, low_memory=False,
-                                       dtype={'thickness_mm': float, 'material': str})
+                                       dtype=MATERIALS_CSV_DTYPES)
             logger.info(f"Успешно прочитаны файлы с кодировкой: {encoding}")
 
             # Проверим, получены ли поля корректно
@@ -86,6 +121,11 @@ def read_csv_files(details_path, materials_path, encodings):
             details_df['f_short'] = details_df['f_ширина']
             logger.info("Колонка 'f_ширина' преобразована в 'f_short'")
 
+    # Запоминаем результат для повторных запусков на тех же файлах
+    if stamps is not None and details_df is not None and materials_df is not None:
+        _csv_cache[cache_key] = (
+            stamps, details_df.copy(), materials_df.copy())
+
     return details_df, materials_df
 
 
@@ -174,16 +214,9 @@ def preprocess_dataframes(details_df, materials_df):
             logger.info(
                 "Добавлена колонка 'material' в таблицу материалов со значением 'S' по умолчанию")
 
-        # Приводим material к верхнему регистру для консистентности
-        details_df['material'] = details_df['material'].astype(str).str.upper()
-        materials_df['material'] = materials_df['material'].astype(
-            str).str.upper()
-
-        # Заменяем пустые значения на 'S'
-        details_df['material'] = details_df['material'].replace(
-            '', 'S').fillna('S')
-        materials_df['material'] = materials_df['material'].replace(
-            '', 'S').fillna('S')
+        # Приводим material к верхнему регистру, пустые значения заменяем на 'S'
+        details_df['material'] = normalize_material(details_df['material'])
+        materials_df['material'] = normalize_material(materials_df['material'])
 
         # Обработка числовых колонок в details_df
         numeric_columns_details = [
@@ -234,6 +267,25 @@ def preprocess_dataframes(details_df, materials_df):
         return None, None
 
 
+def normalize_material(values):
+    """
+    Приводит коды материалов к верхнему регистру и заменяет пустые значения на 'S'.
+    Строковые операции выполняются один раз для каждого уникального кода,
+    а не для каждой строки таблицы.
+
+    Args:
+        values: Series с кодами материалов
+
+    Returns:
+        Series: нормализованные коды материалов с тем же индексом
+    """
+    codes, uniques = pd.factorize(values)
+    # Последний элемент 'S' соответствует коду -1 (пустое значение)
+    normalized = np.array([str(u).upper() or 'S' for u in uniques] + ['S'],
+                          dtype=object)
+    return pd.Series(normalized[codes], index=values.index, dtype=str)
+
+
 def check_critical_values(details_df, materials_df):
     """
     Проверяет критические значения в DataFrame
@@ -245,30 +297,30 @@ def check_critical_values(details_df, materials_df):
     Returns:
         bool: True если данные корректны
     """
-    # Проверка на пустые значения в важных колонках
-    critical_columns_details = ['length_mm',
-                                'width_mm', 'quantity', 'thickness_mm', 'material']
-    critical_columns_materials = [
-        'sheet_length_mm', 'sheet_width_mm', 'total_quantity', 'thickness_mm', 'material'
-    ]
+    # Числовые колонки проверяются как единые массивы float64 (пустые значения - NaN)
+    details_values = details_df[_CRITICAL_NUMERIC_DETAILS].to_numpy(
+        dtype=np.float64, na_value=np.nan)
+    materials_values = materials_df[_CRITICAL_NUMERIC_MATERIALS].to_numpy(
+        dtype=np.float64, na_value=np.nan)
 
-    if details_df[critical_columns_details].isnull().any().any():
+    # Проверка на пустые значения в важных колонках
+    if np.isnan(details_values).any() or details_df['material'].isna().any():
         logger.error(
             "Обнаружены пустые значения в важных колонках таблицы деталей")
         return False
 
-    if materials_df[critical_columns_materials].isnull().any().any():
+    if np.isnan(materials_values).any() or materials_df['material'].isna().any():
         logger.error(
             "Обнаружены пустые значения в важных колонках таблицы материалов")
         return False
 
-    # Проверка на отрицательные значения для числовых колонок
-    if (details_df[['length_mm', 'width_mm', 'quantity']] < 0).any().any():
+    # Проверка на отрицательные значения для размеров и количества
+    if (details_values[:, :3] < 0).any():
         logger.error(
             "Обнаружены отрицательные значения в размерах или количестве деталей")
         return False
 
-    if (materials_df[['sheet_length_mm', 'sheet_width_mm', 'total_quantity']] < 0).any().any():
+    if (materials_values[:, :3] < 0).any():
         logger.error(
             "Обнаружены отрицательные значения в размерах или количестве листов")
         return False